@@ -1,23 +1,95 @@
 # agents.py
 
-from inference import query_model
+import time
+from inference import query_model, stream_model
+from cache import get_completion_cache
+from telemetry import span
 
 
 class BaseAgent:
-    def __init__(self, model=None, openai_api_key=None, base_url=None):
+    def __init__(self, model=None, openai_api_key=None, base_url=None, use_cache=True):
         self.model = model
         self.openai_api_key = openai_api_key
         self.base_url = base_url
+        self.use_cache = use_cache
+
+    def _cache_lookup(self, system_prompt, prompt, temp):
+        """Return (cache, key, cached response) for this call; cache is None when bypassed."""
+        if not self.use_cache:
+            return None, None, None
+        try:
+            cache = get_completion_cache()
+            if cache is None:
+                return None, None, None
+            key = cache.make_key(self.model, system_prompt, prompt, temp)
+            return cache, key, cache.get(key)
+        except Exception as e:
+            print(f"Completion cache lookup failed: {e}")
+            return None, None, None
+
+    def _cache_store(self, cache, key, response):
+        # Empty responses are API failures; never cache them.
+        if cache is None or not response:
+            return
+        try:
+            cache.set(key, response)
+        except Exception as e:
+            print(f"Completion cache write failed: {e}")
+
+    def _span(self):
+        return span("llm.inference", agent=type(self).__name__, model=self.model)
 
     def inference(self, prompt, temp=0.7):
-        return query_model(
-            model_str=self.model,
-            prompt=prompt,
-            temp=temp,
-            openai_api_key=self.openai_api_key,
-            base_url=self.base_url,
-            system_prompt=self.system_prompt()
-        )
+        with self._span() as s:
+            system_prompt = self.system_prompt()
+            cache, key, cached = self._cache_lookup(system_prompt, prompt, temp)
+            if cached is not None:
+                s.set(cache_hits=1)
+                return cached
+
+            response = query_model(
+                model_str=self.model,
+                prompt=prompt,
+                temp=temp,
+                openai_api_key=self.openai_api_key,
+                base_url=self.base_url,
+                system_prompt=system_prompt
+            )
+            self._cache_store(cache, key, response)
+            return response
+
+    def stream_inference(self, prompt, temp=0.7):
+        """Yield the response in chunks as it is generated; cached responses arrive whole."""
+        with self._span() as s:
+            system_prompt = self.system_prompt()
+            cache, key, cached = self._cache_lookup(system_prompt, prompt, temp)
+            if cached is not None:
+                s.set(cache_hits=1)
+                yield cached
+                return
+
+            chunks = []
+            try:
+                for chunk in stream_model(
+                    model_str=self.model,
+                    prompt=prompt,
+                    temp=temp,
+                    openai_api_key=self.openai_api_key,
+                    base_url=self.base_url,
+                    system_prompt=system_prompt
+                ):
+                    if not chunks:
+                        s.set(first_chunk_seconds=round(time.time() - s.start, 6))
+                    chunks.append(chunk)
+                    yield chunk
+            except Exception as e:
+                # stream_model raises once text has been yielded, so a partial
+                # response is shown as it is but never cached.
+                print(f"Stream interrupted: {e}")
+                return
+            # Only reached when the stream ran to completion, so aborted
+            # generations are never cached.
+            self._cache_store(cache, key, "".join(chunks))
 
 
 class SubTopicAgent(BaseAgent):
@@ -0,0 +1,213 @@
+# batch.py
+"""
+Run many research topics through one shared pipeline:
+
+    python batch.py topics.txt --max-papers 30 --topics-concurrency 4
+
+The topics file has one topic per line (blank lines and # comments are
+skipped), or is a .json list whose entries are topics or dicts of
+run_workflow arguments, e.g. {"research_topic": ..., "start_year": 2022}.
+
+Every topic gets its own run directory under database/batches/<batch id>/,
+and manifest.json there summarises the batch. All topics share one
+ArxivSearch (and with it arXiv's politeness delay), the pooled LLM clients
+with their rate limits, the on-disk caches and the embedding model.
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from inference import close_clients, configure_rate_limits
+from pipeline import run_workflow
+from run_context import DATABASE_DIR, RunContext, new_run_id
+from telemetry import start_metrics_server
+from tools import ArxivSearch, warm_up_embedder
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+BATCHES_DIR = os.path.join(DATABASE_DIR, "batches")
+MANIFEST_FILE = "manifest.json"
+
+
+def load_topics(path):
+    """The topics file as a list of dicts with at least research_topic."""
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".json"):
+            entries = json.load(f)
+        else:
+            entries = [line.strip() for line in f]
+            entries = [line for line in entries if line and not line.startswith("#")]
+    return [entry if isinstance(entry, dict) else {"research_topic": entry} for entry in entries]
+
+
+def slugify(text, length=40):
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")[:length] or "topic"
+
+
+def previous_runs(manifest_path):
+    """{topic: run directory} of the successful runs in an earlier batch manifest."""
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    return {entry["research_topic"]: entry["directory"]
+            for entry in manifest["topics"] if entry["status"] == "done"}
+
+
+class Batch:
+    """
+    One batch run: schedules the topics on up to topics_concurrency threads
+    and keeps manifest.json up to date as they finish, so a batch that is
+    interrupted still records what it completed.
+    """
+
+    def __init__(self, topics, defaults, directory, topics_concurrency=4, arxiv_engine=None, previous=None):
+        self.topics = topics
+        self.defaults = defaults
+        self.directory = directory
+        self.topics_concurrency = topics_concurrency
+        self.arxiv_engine = arxiv_engine or ArxivSearch()
+        self.previous = previous or {}
+        self.manifest = {
+            "batch_id": os.path.basename(directory),
+            "started_at": datetime.now().isoformat(),
+            "finished_at": None,
+            "settings": {k: v for k, v in defaults.items() if k != "open_ai_key"},
+            "topics": [],
+        }
+        self._lock = threading.Lock()
+
+    def run_topic(self, index, params):
+        topic = params["research_topic"]
+        run = RunContext(f"{index:03d}-{slugify(topic)}", root=self.directory)
+        entry = {"research_topic": topic, "run_id": run.run_id, "directory": run.directory}
+        previous_run_dir = params.get("previous_run_dir", self.previous.get(topic))
+        if previous_run_dir:
+            entry["previous_run_dir"] = previous_run_dir
+        started = time.perf_counter()
+        try:
+            outcome = run_workflow(
+                **{**self.defaults, **params, "previous_run_dir": previous_run_dir},
+                run=run,
+                arxiv_engine=self.arxiv_engine,
+                on_stage=lambda name, status: logger.info(f"[{topic}] Stage '{name}': {status}")
+            )
+            review = outcome["results"].get("review")
+            entry.update(
+                status="done" if review else "failed",
+                stages=outcome["status"],
+                timings=outcome["timings"],
+                papers=sum(len(papers) for papers in review["sub_topics"].values()) if review else 0
+            )
+            if review and "new_papers" in review["metadata"]:
+                entry["new_papers"] = review["metadata"]["new_papers"]
+        except Exception as e:
+            logger.error(f"[{topic}] Workflow failed: {e}")
+            entry.update(status="failed", error=str(e))
+        entry["seconds"] = round(time.perf_counter() - started, 3)
+        return entry
+
+    def save_manifest(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, path)
+        return path
+
+    def run(self):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.topics_concurrency) as executor:
+            futures = [executor.submit(self.run_topic, i, params)
+                       for i, params in enumerate(self.topics, 1)]
+            for future in as_completed(futures):
+                entry = future.result()
+                logger.info(f"[{entry['research_topic']}] {entry['status']} in {entry['seconds']:.1f}s")
+                with self._lock:
+                    self.manifest["topics"].append(entry)
+                    self.save_manifest()
+
+        order = {params["research_topic"]: i for i, params in enumerate(self.topics)}
+        self.manifest["topics"].sort(key=lambda entry: order.get(entry["research_topic"], 0))
+        elapsed = time.perf_counter() - started
+        done = sum(entry["status"] == "done" for entry in self.manifest["topics"])
+        self.manifest.update(
+            finished_at=datetime.now().isoformat(),
+            seconds=round(elapsed, 3),
+            done=done,
+            failed=len(self.manifest["topics"]) - done,
+            topics_per_minute=round(len(self.topics) / elapsed * 60, 3) if elapsed else None
+        )
+        return self.save_manifest()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a literature review for every topic in a file.")
+    parser.add_argument("topics_file")
+    parser.add_argument("--max-papers", type=int, default=18)
+    parser.add_argument("--start-year", type=int, default=2005)
+    parser.add_argument("--end-year", type=int, default=datetime.now().year)
+    parser.add_argument("--report-mode", default="per_section", choices=("per_section", "single_call"))
+    parser.add_argument("--no-report", action="store_true", help="skip the literature report")
+    parser.add_argument("--no-novel-approach", action="store_true", help="skip the novel approach")
+    parser.add_argument("--base-url", default=os.getenv("OPENAI_BASE_URL"))
+    parser.add_argument("--topics-concurrency", type=int, default=int(os.getenv("REPER_BATCH_TOPICS", 4)),
+                        help="topics in flight at once")
+    parser.add_argument("--llm-concurrency", type=int, help="LLM requests in flight at once, over all topics")
+    parser.add_argument("--llm-rpm", type=int, help="LLM requests per minute, over all topics")
+    parser.add_argument("--llm-tpm", type=int, help="LLM tokens per minute, over all topics")
+    parser.add_argument("--retrieval-mode", default="live", choices=("live", "hybrid", "offline"))
+    parser.add_argument("--update", metavar="MANIFEST",
+                        help="update the runs of an earlier batch incrementally instead of starting over")
+    parser.add_argument("--output-dir", help=f"default: {BATCHES_DIR}/<batch id>")
+    args = parser.parse_args(argv)
+
+    topics = load_topics(args.topics_file)
+    directory = args.output_dir or os.path.join(BATCHES_DIR, new_run_id())
+    defaults = dict(
+        max_value=args.max_papers,
+        open_ai_key=os.getenv("OPENAI_API_KEY"),
+        base_url=args.base_url,
+        start_year=args.start_year,
+        end_year=args.end_year,
+        generate_report_flag=not args.no_report,
+        generate_novel_approach_flag=not args.no_novel_approach,
+        report_mode=args.report_mode
+    )
+
+    # The limits apply per endpoint across every topic, because all of them
+    # share the same pooled clients and limiters.
+    configure_rate_limits(rpm=args.llm_rpm, tpm=args.llm_tpm, max_concurrency=args.llm_concurrency)
+    start_metrics_server()
+    # Ranking needs the embedding model in every mode, and offline retrieval
+    # embeds each sub-topic query as well.
+    warm_up_embedder()
+
+    logger.info(f"Running {len(topics)} topics, {args.topics_concurrency} at a time, into {directory}")
+    batch = Batch(
+        topics, defaults, directory,
+        topics_concurrency=args.topics_concurrency,
+        arxiv_engine=ArxivSearch(retrieval_mode=args.retrieval_mode),
+        previous=previous_runs(args.update) if args.update else None
+    )
+    try:
+        manifest_path = batch.run()
+    finally:
+        close_clients()
+    manifest = batch.manifest
+    logger.info(f"{manifest['done']} of {len(topics)} topics done in {manifest['seconds']:.1f}s; "
+                f"manifest written to {manifest_path}")
+    return 0 if not manifest["failed"] else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,115 @@
+# benchmarks/arxiv_fixtures.py
+
+import json
+import os
+import random
+import threading
+import zlib
+from datetime import datetime, timezone
+
+from benchmarks.mock_llm import WORDS
+
+
+class FixtureResult:
+    """The parts of arxiv.Result that Paper.from_result reads."""
+
+    def __init__(self, title, arxiv_id, published, summary, link):
+        self.title = title
+        self._short_id = arxiv_id
+        self.published = datetime.fromisoformat(published)
+        self.summary = summary
+        self.entry_id = link
+
+    def get_short_id(self):
+        return self._short_id
+
+    @classmethod
+    def from_result(cls, result):
+        return cls(result.title, result.get_short_id(), result.published.isoformat(),
+                   result.summary, result.entry_id)
+
+    def to_dict(self):
+        return {
+            "title": self.title,
+            "arxiv_id": self._short_id,
+            "published": self.published.isoformat(),
+            "summary": self.summary,
+            "link": self.entry_id
+        }
+
+
+class FixtureArxivClient:
+    """
+    Replays recorded arXiv responses, keyed by the search query; a drop-in
+    for arxiv.Client in ArxivSearch(client=...). Queries that were never
+    recorded get deterministic synthetic papers (seeded by the query), so a
+    benchmark runs offline with or without a fixture file; stats counts the
+    queries answered each way.
+    """
+
+    def __init__(self, path=None, synthesize=True, start_year=2015, end_year=2025):
+        self.fixtures = {}
+        self.synthesize = synthesize
+        self.stats = {"recorded": 0, "synthetic": 0}
+        self._lock = threading.Lock()
+        self.start_year = start_year
+        self.end_year = end_year
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.fixtures = json.load(f)
+
+    def results(self, search):
+        recorded = self.fixtures.get(search.query)
+        if recorded is None and not self.synthesize:
+            raise KeyError(f"No arXiv fixture for query {search.query!r}")
+        with self._lock:
+            self.stats["recorded" if recorded is not None else "synthetic"] += 1
+        if recorded is not None:
+            return [FixtureResult(**r) for r in recorded[:search.max_results]]
+        return self._synthetic(search.query, search.max_results)
+
+    def _synthetic(self, query, count):
+        rng = random.Random(zlib.crc32(query.encode("utf-8")))
+        results = []
+        for i in range(count):
+            arxiv_id = f"{rng.randint(1500, 2512)}.{rng.randint(0, 99999):05d}v1"
+            year = rng.randint(self.start_year, self.end_year)
+            published = datetime(year, rng.randint(1, 12), rng.randint(1, 28), tzinfo=timezone.utc)
+            summary = " ".join(rng.choice(WORDS) for _ in range(rng.randint(120, 220)))
+            results.append(FixtureResult(
+                title=f"{query} study {i}: " + " ".join(rng.sample(WORDS, 4)),
+                arxiv_id=arxiv_id,
+                published=published.isoformat(),
+                summary=summary,
+                link=f"http://arxiv.org/abs/{arxiv_id}"
+            ))
+        return results
+
+
+class RecordingArxivClient:
+    """Wraps a real arxiv.Client and saves every response as a fixture."""
+
+    def __init__(self, path, client=None):
+        import arxiv
+
+        self.path = path
+        self.client = client or arxiv.Client()
+        self._lock = threading.Lock()
+        self.fixtures = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.fixtures = json.load(f)
+
+    def results(self, search):
+        results = [FixtureResult.from_result(r) for r in self.client.results(search)]
+        with self._lock:
+            self.fixtures[search.query] = [r.to_dict() for r in results]
+            self.save()
+        return results
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.fixtures, f, indent=1)
+        os.replace(tmp_path, self.path)
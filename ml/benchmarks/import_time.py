@@ -0,0 +1,96 @@
+# benchmarks/import_time.py
+"""
+Cold-start guard: import the modules the Streamlit app loads at startup in
+fresh interpreters and check that they stay within the time budget and do
+not pull in the heavy ML and API dependencies.
+
+Run from the ml/ directory:
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --budget-ms 300 --repeat 5
+
+Exits with status 1 when the budget is exceeded or a heavy module is loaded.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# What streamlit_app.py imports from this project (streamlit itself excluded).
+STARTUP_MODULES = ("pipeline", "generate_report", "run_context", "jobs", "tools", "telemetry")
+
+# Only a ranking/embedding stage or an actual API call may import these.
+HEAVY_MODULES = ("torch", "sentence_transformers", "numpy", "openai", "arxiv")
+
+DEFAULT_BUDGET_MS = float(os.getenv("REPER_IMPORT_BUDGET_MS", 500))
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed,
+                  "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(modules=STARTUP_MODULES, heavy=HEAVY_MODULES, cwd=None):
+    """Import modules in a new interpreter; returns (seconds, heavy modules loaded)."""
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(modules=tuple(modules), heavy=tuple(heavy))],
+        cwd=cwd or os.getcwd(), capture_output=True, text=True, check=True
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    return result["seconds"], result["heavy"]
+
+
+def slowest_imports(modules=STARTUP_MODULES, top=10, cwd=None):
+    """The top cumulative entries of python -X importtime for the modules."""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + ", ".join(modules)],
+        cwd=cwd or os.getcwd(), capture_output=True, text=True
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            rows.append((int(cumulative), name.rstrip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--repeat", type=int, default=3, help="best of this many runs is compared")
+    parser.add_argument("--verbose", action="store_true", help="list the slowest imports")
+    args = parser.parse_args(argv)
+
+    timings, heavy = [], set()
+    for _ in range(args.repeat):
+        seconds, loaded = measure()
+        timings.append(seconds * 1000)
+        heavy.update(loaded)
+    best = min(timings)
+    print(f"Startup imports: best {best:.0f} ms, worst {max(timings):.0f} ms "
+          f"(budget {args.budget_ms:.0f} ms)")
+    if args.verbose or best > args.budget_ms:
+        for cumulative, name in slowest_imports():
+            print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    failed = False
+    if best > args.budget_ms:
+        print("FAIL: startup imports exceed the budget")
+        failed = True
+    if heavy:
+        print(f"FAIL: heavy modules imported at startup: {', '.join(sorted(heavy))}")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
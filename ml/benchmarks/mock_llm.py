@@ -0,0 +1,171 @@
+# benchmarks/mock_llm.py
+
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "model", "training", "retrieval", "benchmark", "dataset", "evaluation", "attention",
+    "transformer", "latent", "representation", "robustness", "generalization", "scaling",
+    "inference", "architecture", "baseline", "ablation", "objective", "alignment", "sparse",
+)
+
+# Opening of SubTopicAgent's system prompt; other agents mention sub-topics too.
+SUB_TOPIC_PROMPT = "Generate 5-7 specific research sub-topics"
+
+
+class MockLLMServer:
+    """
+    Local OpenAI-compatible /chat/completions endpoint for benchmarks.
+
+    Every request waits latency seconds (time to first token), then produces
+    completion_tokens words at tokens_per_second, streamed or whole (with a
+    final usage chunk only if stream_options.include_usage is set). A
+    fraction error_rate of requests fails with error_status instead, carrying
+    a retry-after-ms header. Responses are seeded, so runs are repeatable.
+    """
+
+    def __init__(self, latency=0.2, tokens_per_second=200.0, completion_tokens=150,
+                 error_rate=0.0, error_status=429, retry_after_ms=50, seed=0,
+                 host="127.0.0.1", port=0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after_ms = retry_after_ms
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1/"
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="mock-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _count(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self.stats[name] += value
+
+    def _should_fail(self):
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def _completion_words(self, messages):
+        system_prompt = messages[0]["content"] if messages else ""
+        if SUB_TOPIC_PROMPT in system_prompt:
+            # SubTopicAgent's expected format: a numbered list of short phrases.
+            return [f"{i}. Synthetic sub-topic {WORDS[i]} {WORDS[-i]}\n" for i in range(1, 6)]
+        with self._lock:
+            return [self._random.choice(WORDS) + " " for _ in range(self.completion_tokens)]
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not self.path.endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+                    return
+                request = json.loads(body or b"{}")
+                server._count(requests=1)
+
+                time.sleep(server.latency)
+                if server._should_fail():
+                    server._count(errors=1)
+                    self._send_json(server.error_status,
+                                    {"error": {"message": "Injected failure", "type": "mock_error"}},
+                                    {"retry-after-ms": str(server.retry_after_ms)})
+                    return
+
+                messages = request.get("messages", [])
+                words = server._completion_words(messages)
+                usage = {
+                    "prompt_tokens": sum(len(m.get("content", "")) for m in messages) // 4,
+                    "completion_tokens": len(words),
+                }
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                server._count(prompt_tokens=usage["prompt_tokens"],
+                              completion_tokens=usage["completion_tokens"])
+                model = request.get("model", "mock")
+                if request.get("stream"):
+                    include_usage = (request.get("stream_options") or {}).get("include_usage")
+                    self._stream(model, words, usage if include_usage else None)
+                else:
+                    time.sleep(len(words) / server.tokens_per_second)
+                    self._send_json(200, {
+                        "id": "chatcmpl-mock",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{
+                            "index": 0,
+                            "message": {"role": "assistant", "content": "".join(words).strip()},
+                            "finish_reason": "stop",
+                        }],
+                        "usage": usage,
+                    })
+
+            def _stream(self, model, words, usage):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+
+                def event(payload):
+                    self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+
+                chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk",
+                         "created": int(time.time()), "model": model}
+                for word in words:
+                    time.sleep(1 / server.tokens_per_second)
+                    event({**chunk, "choices": [
+                        {"index": 0, "delta": {"content": word}, "finish_reason": None}]})
+                event({**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+                # Like OpenAI, usage is only streamed when the client asks for it.
+                if usage is not None:
+                    event({**chunk, "choices": [], "usage": usage})
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+            def _send_json(self, status, payload, headers=None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,258 @@
+# benchmarks/run_benchmark.py
+"""
+End-to-end benchmark of the review pipeline against a local mock LLM server
+and replayed arXiv fixtures, so that results only depend on the code.
+
+Run from the ml/ directory:
+
+    python -m benchmarks.run_benchmark --iterations 5
+    python -m benchmarks.run_benchmark --compare <commit or results file>
+
+No fixture file is committed: until one is recorded with --record (which
+queries live arXiv once), every query is answered with deterministic
+synthetic papers. Results state which was used in config.arxiv_data
+("recorded", "synthetic", "mixed" or "live"), and runs are only comparable
+when it matches.
+
+Each iteration runs perform_literature_review, generate_literature_report and
+propose_novel_approach_and_save in a fresh run directory, with every on-disk
+cache disabled. p50/p95 latency per stage, throughput and peak RSS are
+written to benchmarks/results/<commit>.json for comparison across commits.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.arxiv_fixtures import FixtureArxivClient, RecordingArxivClient
+from benchmarks.mock_llm import MockLLMServer
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+STAGES = ("review", "report", "novel_approach", "total")
+
+
+def percentile(values, q):
+    """Nearest-rank percentile; q in [0, 100]."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux, bytes on macOS.
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, dirty
+
+
+def arxiv_data(arxiv_client):
+    """Where the benchmark's arXiv results came from."""
+    if isinstance(arxiv_client, RecordingArxivClient):
+        return "live"
+    stats = arxiv_client.stats
+    if stats["recorded"] and stats["synthetic"]:
+        return "mixed"
+    return "recorded" if stats["recorded"] else "synthetic"
+
+
+def run_iteration(args, base_url, arxiv_client, root):
+    # Imported here so that --help and --compare stay fast.
+    from literature_review import perform_literature_review
+    from generate_report import generate_literature_report
+    from novel_ideas import propose_novel_approach_and_save
+    from run_context import RunContext
+    from tools import ArxivSearch, RateLimiter
+
+    run = RunContext(root=root)
+    engine = ArxivSearch(rate_limiter=RateLimiter(0), use_cache=False, client=arxiv_client)
+    timings = {}
+
+    started = time.perf_counter()
+    review = perform_literature_review(
+        args.topic, args.start_year, args.end_year, max_count=args.papers,
+        open_ai_key="benchmark", base_url=base_url, rank=args.rank,
+        run=run, arxiv_engine=engine)
+    timings["review"] = time.perf_counter() - started
+    if review is None:
+        raise RuntimeError("Literature review failed")
+
+    stage_started = time.perf_counter()
+    generate_literature_report(open_ai_key="benchmark", base_url=base_url,
+                               mode=args.report_mode, data=review, run=run)
+    timings["report"] = time.perf_counter() - stage_started
+
+    stage_started = time.perf_counter()
+    propose_novel_approach_and_save(open_ai_key="benchmark", base_url=base_url,
+                                    data=review, run=run)
+    timings["novel_approach"] = time.perf_counter() - stage_started
+    timings["total"] = time.perf_counter() - started
+    return timings
+
+
+def run_benchmark(args):
+    os.environ["REPER_DISABLE_CACHE"] = "1"
+    from telemetry import METRICS
+
+    if args.record:
+        arxiv_client = RecordingArxivClient(args.fixtures)
+    else:
+        if not os.path.exists(args.fixtures):
+            print(f"No arXiv fixtures at {args.fixtures}; using synthetic papers "
+                  f"(record real ones with --record)")
+        arxiv_client = FixtureArxivClient(args.fixtures, start_year=args.start_year, end_year=args.end_year)
+
+    server = MockLLMServer(
+        latency=args.latency, tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens, error_rate=args.error_rate,
+        error_status=args.error_status, seed=args.seed)
+    samples = {stage: [] for stage in STAGES}
+    with server, tempfile.TemporaryDirectory(prefix="reper-bench-") as root:
+        for i in range(args.warmup + args.iterations):
+            if i == args.warmup:
+                METRICS.reset()
+                for name in server.stats:
+                    server.stats[name] = 0
+                measured_from = time.perf_counter()
+            output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+            with output:
+                timings = run_iteration(args, server.base_url, arxiv_client, root)
+            if i >= args.warmup:
+                for stage in STAGES:
+                    samples[stage].append(timings[stage])
+            print(f"{'warm-up' if i < args.warmup else 'iteration'} {i + 1}: {timings['total']:.2f}s")
+        elapsed = time.perf_counter() - measured_from
+
+    commit, dirty = git_commit()
+    spans = METRICS.snapshot()
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {**{k: v for k, v in vars(args).items() if k not in ("compare", "output", "verbose")},
+                   "arxiv_data": arxiv_data(arxiv_client)},
+        "stages": {
+            stage: {
+                "p50": round(percentile(values, 50), 4),
+                "p95": round(percentile(values, 95), 4),
+                "mean": round(sum(values) / len(values), 4),
+                "n": len(values),
+            } for stage, values in samples.items()
+        },
+        "throughput_runs_per_min": round(args.iterations / elapsed * 60, 3),
+        "llm": {**server.stats, "requests_per_second": round(server.stats["requests"] / elapsed, 3)},
+        "spans": {name: {"count": entry["count"], "seconds": round(entry["seconds"], 4)}
+                  for name, entry in spans.items()},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def save_result(result, output=None):
+    if output is None:
+        name = result["commit"][:12] + ("-dirty" if result["dirty"] else "")
+        output = os.path.join(RESULTS_DIR, f"{name}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    return output
+
+
+def load_result(ref):
+    """A results file path, or a commit (prefix) with a file in RESULTS_DIR."""
+    if os.path.exists(ref):
+        path = ref
+    else:
+        matches = sorted(name for name in os.listdir(RESULTS_DIR) if name.startswith(ref[:12]))
+        if not matches:
+            raise FileNotFoundError(f"No benchmark results for {ref!r} in {RESULTS_DIR}")
+        path = os.path.join(RESULTS_DIR, matches[0])
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(baseline, result):
+    print(f"\n{'stage':<16}{'metric':<8}{'baseline':>10}{'current':>10}{'change':>9}")
+    rows = [(stage, metric, baseline["stages"][stage][metric], result["stages"][stage][metric])
+            for stage in STAGES for metric in ("p50", "p95")
+            if stage in baseline["stages"] and stage in result["stages"]]
+    rows.append(("throughput", "runs/m", baseline["throughput_runs_per_min"], result["throughput_runs_per_min"]))
+    if baseline.get("peak_rss_mb") and result.get("peak_rss_mb"):
+        rows.append(("peak_rss", "MB", baseline["peak_rss_mb"], result["peak_rss_mb"]))
+    for stage, metric, before, after in rows:
+        change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+        print(f"{stage:<16}{metric:<8}{before:>10.3f}{after:>10.3f}{change:>9}")
+
+
+def print_summary(result):
+    print(f"\n{'stage':<16}{'p50 (s)':>10}{'p95 (s)':>10}")
+    for stage, stats in result["stages"].items():
+        print(f"{stage:<16}{stats['p50']:>10.3f}{stats['p95']:>10.3f}")
+    llm = result["llm"]
+    print(f"\nThroughput: {result['throughput_runs_per_min']:.2f} runs/min, "
+          f"{llm['requests_per_second']:.2f} LLM requests/s ({llm['errors']} injected errors)")
+    print(f"Peak RSS: {result['peak_rss_mb']} MB")
+    print(f"arXiv data: {result['config']['arxiv_data']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--topic", default="Large language models for code generation")
+    parser.add_argument("--start-year", type=int, default=2018)
+    parser.add_argument("--end-year", type=int, default=2025)
+    parser.add_argument("--papers", type=int, default=30, help="max_count of the review")
+    parser.add_argument("--report-mode", default="per_section", choices=("per_section", "single_call"))
+    parser.add_argument("--no-rank", dest="rank", action="store_false",
+                        help="skip embedding ranking (and loading the embedding model)")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1, help="iterations run before measuring")
+    parser.add_argument("--latency", type=float, default=0.2, help="mock LLM time to first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--completion-tokens", type=int, default=150)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of LLM requests that fail")
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fixtures", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                           "fixtures", "arxiv.json"),
+                        help="recorded arXiv responses (not committed; see --record); "
+                             "unknown queries get synthetic papers")
+    parser.add_argument("--record", action="store_true",
+                        help="query live arXiv and save the responses to --fixtures")
+    parser.add_argument("--output", help="results file (default: results/<commit>.json)")
+    parser.add_argument("--compare", help="commit or results file to compare against")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's own output")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = run_benchmark(args)
+    print_summary(result)
+    print(f"\nResults saved to {save_result(result, args.output)}")
+    if args.compare:
+        compare(load_result(args.compare), result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+# cache.py
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_DIR = os.getenv("REPER_CACHE_DIR", ".cache")
+
+
+def cache_disabled():
+    """Set REPER_DISABLE_CACHE=1 to bypass every on-disk cache."""
+    return os.getenv("REPER_DISABLE_CACHE", "").lower() in ("1", "true", "yes")
+
+
+class CompletionCache:
+    """
+    On-disk cache of LLM completions, keyed by a hash of the model, system
+    prompt, user prompt and temperature. Entries expire after ttl seconds and
+    the least recently used ones are evicted once the stored responses exceed
+    max_bytes. Safe to share between threads; SQLite handles other processes.
+    """
+
+    def __init__(self, path=None, ttl=7 * 24 * 3600, max_bytes=100 * 1024 * 1024):
+        self.path = path or os.path.join(CACHE_DIR, "completions.sqlite")
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(
+            self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS completions_lru ON completions (accessed_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model, system_prompt, prompt, temp):
+        payload = json.dumps([model, system_prompt, prompt, temp])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._conn.execute(
+                        "DELETE FROM completions WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key, response):
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        self._conn.execute(
+            "DELETE FROM completions WHERE created_at < ?", (now - self.ttl,))
+        total = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        stale = []
+        for key, size in self._conn.execute(
+                "SELECT key, size FROM completions ORDER BY accessed_at"):
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM completions WHERE key = ?", stale)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM completions")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+
+_completion_cache = None
+_cache_singletons_lock = threading.Lock()
+
+
+def get_completion_cache():
+    """Return the process-wide completion cache, or None when caching is disabled."""
+    global _completion_cache
+    if cache_disabled():
+        return None
+    with _cache_singletons_lock:
+        if _completion_cache is None:
+            _completion_cache = CompletionCache()
+    return _completion_cache
+
+
+class ArxivQueryCache:
+    """
+    On-disk cache of arXiv search results, keyed by normalized query, N and
+    sort criterion. Each entry stores the structured papers, when they were
+    fetched and the newest `published` timestamp among them, so that stale
+    entries can be refreshed incrementally instead of re-fetched in full.
+    """
+
+    def __init__(self, path=None, max_age=24 * 3600):
+        self.path = path or os.path.join(CACHE_DIR, "arxiv_queries.sqlite")
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(
+            self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS arxiv_queries ("
+            " key TEXT PRIMARY KEY,"
+            " papers TEXT NOT NULL,"
+            " latest_published TEXT,"
+            " fetched_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(query, N, sort_by):
+        normalized = " ".join(query.lower().split())
+        return json.dumps([normalized, N, sort_by])
+
+    def get(self, key):
+        """Return (papers, latest_published, fetched_at) or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT papers, latest_published, fetched_at FROM arxiv_queries WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if self.is_fresh(row[2]):
+                self.hits += 1
+            else:
+                self.misses += 1
+        return json.loads(row[0]), row[1], row[2]
+
+    def is_fresh(self, fetched_at):
+        return time.time() - fetched_at <= self.max_age
+
+    def put(self, key, papers):
+        latest = max((p["published"] for p in papers), default=None)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO arxiv_queries VALUES (?, ?, ?, ?)",
+                (key, json.dumps(papers), latest, time.time())
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM arxiv_queries")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute(
+                "SELECT COUNT(*) FROM arxiv_queries").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+
+_arxiv_query_cache = None
+
+
+def get_arxiv_query_cache():
+    """Return the process-wide arXiv query cache, or None when caching is disabled."""
+    global _arxiv_query_cache
+    if cache_disabled():
+        return None
+    with _cache_singletons_lock:
+        if _arxiv_query_cache is None:
+            _arxiv_query_cache = ArxivQueryCache(
+                max_age=float(os.getenv("REPER_ARXIV_CACHE_TTL", 24 * 3600)))
+    return _arxiv_query_cache
@@ -0,0 +1,175 @@
+# embedding_store.py
+
+import json
+import os
+import re
+import threading
+import numpy as np
+from cache import CACHE_DIR, cache_disabled
+from telemetry import record, span
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process lock only
+    fcntl = None
+
+
+class EmbeddingStore:
+    """
+    On-disk embeddings of arXiv abstracts for one model, keyed by arXiv ID.
+
+    Vectors live in a memory-mapped .npy matrix (float16 by default) that
+    grows by doubling; a JSON index maps row number to arXiv ID. Lookups only
+    touch the requested rows of the map, and only papers that have never been
+    seen need to go through the model. Vectors are stored L2-normalized.
+    """
+
+    def __init__(self, model_name, directory=None, dtype="float16"):
+        self.model_name = model_name
+        self.directory = directory or os.path.join(CACHE_DIR, "embeddings")
+        self.dtype = np.dtype(dtype)
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+        self.matrix_path = os.path.join(
+            self.directory, f"{slug}.{self.dtype.name}.npy")
+        self.index_path = os.path.join(self.directory, f"{slug}.ids.json")
+        self.lock_path = os.path.join(self.directory, f"{slug}.lock")
+
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._ids = []
+        self._rows = {}
+        self._index_mtime = None
+
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            self._reload()
+
+    def __len__(self):
+        with self._lock:
+            self._reload()
+            return len(self._ids)
+
+    def _reload(self):
+        """Re-read the index (and re-map the matrix) if another writer changed it."""
+        try:
+            mtime = os.path.getmtime(self.index_path)
+        except OSError:
+            return
+        if mtime == self._index_mtime:
+            return
+        with open(self.index_path, encoding="utf-8") as f:
+            index = json.load(f)
+        self._ids = index["ids"]
+        self._rows = {arxiv_id: row for row, arxiv_id in enumerate(self._ids)}
+        self._matrix = np.load(self.matrix_path, mmap_mode="r+")
+        self._index_mtime = mtime
+
+    def _file_lock(self):
+        handle = open(self.lock_path, "a")
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+
+    def lookup(self, ids):
+        """Split ids into (known ids, unknown ids), keeping their order."""
+        with self._lock:
+            self._reload()
+            known = [i for i in ids if i in self._rows]
+            missing = [i for i in ids if i not in self._rows]
+        return known, missing
+
+    def get(self, ids):
+        """float32 matrix with one row per id; every id must already be stored."""
+        with self._lock:
+            self._reload()
+            rows = [self._rows[i] for i in ids]
+            if not rows:
+                return np.empty((0, 0), dtype=np.float32)
+            return np.asarray(self._matrix[rows], dtype=np.float32)
+
+    def add(self, ids, vectors):
+        if not len(ids):
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+
+        with self._lock:
+            lock_handle = self._file_lock()
+            try:
+                self._reload()
+                new = [(i, v) for i, v in zip(ids, vectors) if i not in self._rows]
+                if not new:
+                    return
+                count = len(self._ids)
+                self._ensure_capacity(count + len(new), vectors.shape[1])
+                for offset, (arxiv_id, vector) in enumerate(new):
+                    self._matrix[count + offset] = vector
+                    self._rows[arxiv_id] = count + offset
+                    self._ids.append(arxiv_id)
+                self._matrix.flush()
+                self._write_index(vectors.shape[1])
+            finally:
+                lock_handle.close()
+
+    def _ensure_capacity(self, needed, dim):
+        if self._matrix is not None and self._matrix.shape[0] >= needed:
+            return
+        capacity = max(1024, needed)
+        if self._matrix is not None:
+            capacity = max(capacity, 2 * self._matrix.shape[0])
+        tmp_path = self.matrix_path + ".tmp"
+        grown = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=self.dtype, shape=(capacity, dim))
+        count = len(self._ids)
+        if count:
+            grown[:count] = self._matrix[:count]
+        grown.flush()
+        del grown
+        self._matrix = None
+        os.replace(tmp_path, self.matrix_path)
+        self._matrix = np.load(self.matrix_path, mmap_mode="r+")
+
+    def _write_index(self, dim):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_name, "dim": dim, "ids": self._ids}, f)
+        os.replace(tmp_path, self.index_path)
+        self._index_mtime = os.path.getmtime(self.index_path)
+
+    def encode(self, embedder, ids, texts, batch_size=64):
+        """
+        Embeddings for (id, text) pairs, running only the unseen texts
+        through the embedder. Returns a float32 matrix in ids order.
+        """
+        _, missing = self.lookup(ids)
+        record(cache_hits=len(ids) - len(missing))
+        if missing:
+            text_of = dict(zip(ids, texts))
+            with span("embedding.encode", texts=len(missing)):
+                embeds = embedder.encode(
+                    [text_of[i] for i in missing],
+                    batch_size=batch_size,
+                    normalize_embeddings=True,
+                    convert_to_numpy=True
+                )
+            self.add(missing, embeds)
+        return self.get(ids)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_embedding_store(model_name):
+    """Process-wide store for the model, or None when caching is disabled or unavailable."""
+    if cache_disabled():
+        return None
+    with _stores_lock:
+        if model_name not in _stores:
+            try:
+                _stores[model_name] = EmbeddingStore(model_name)
+            except Exception as e:
+                print(f"Embedding store unavailable: {e}")
+                _stores[model_name] = None
+    return _stores[model_name]
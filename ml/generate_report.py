@@ -2,20 +2,227 @@
 
 import os
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from agents import PostdocAgent
+from run_context import RunContext
+from prompt_context import build_paper_context, count_tokens
+from telemetry import wrap, write_file
 
 
-def generate_literature_report(open_ai_key=None, base_url=None):
+# Every report prompt starts with the same system prompt and this corpus
+# block, and only the short section instruction that follows differs. Keeping
+# the shared part byte-identical and first lets OpenAI-compatible providers
+# reuse their prompt cache across sections.
+CORPUS_PREFIX = (
+    "Research topic: {topic}\n\n"
+    "The papers collected for this literature review follow, one JSON object per line:\n\n"
+    "{papers}\n\n"
+    "---\n\n"
+)
+
+ABSTRACT_INSTRUCTION = (
+    "Generate an abstract for a single, cohesive literature review on: {topic}.\n"
+    "Avoid dividing the abstract by sub-topics, just provide a general overview.\n"
+    "Write in a formal academic style."
+)
+
+# (section key, Markdown heading, label used in error messages, instruction)
+# in report order. Each instruction is appended to CORPUS_PREFIX.
+ANALYSIS_SECTIONS = [
+    (
+        "analysis_subtopics",
+        "1. Sub-topics",
+        "Sub-topics analysis",
+        "You are a senior researcher discussing sub-topics as they appear in the papers above.\n"
+        "Discuss how these sub-topics arise collectively across the studies in an integrated manner.\n"
+        "Do NOT create separate headings for each sub-topic. Instead, weave them into a unified narrative.\n"
+        "Write in a formal academic style."
+    ),
+    (
+        "analysis_methodologies",
+        "2. Key methodologies",
+        "Key methodologies",
+        "Analyze the key methodologies used across all of the papers above. "
+        "Discuss them in a unified manner (no separate sub-topic headings). "
+        "Focus on experimental setups, data handling, analysis techniques, etc., in formal academic style."
+    ),
+    (
+        "analysis_findings",
+        "3. Major findings",
+        "Major findings",
+        "Analyze the major findings from the papers above. "
+        "Synthesize the findings into one cohesive discussion. "
+        "Highlight common themes or unique results. Write in formal academic style."
+    ),
+    (
+        "analysis_limitations",
+        "4. Limitations",
+        "Limitations",
+        "Discuss the limitations identified across the papers above. "
+        "Unify them into a single discussion, referencing typical constraints, possible biases, and other weaknesses. "
+        "Write in a formal academic style."
+    ),
+    (
+        "analysis_relationships",
+        "5. Relationships to other studies",
+        "Relationships",
+        "Discuss how the papers above relate to each other and to broader research in the field. "
+        "Highlight interconnections, differences, or complementary findings. Formal academic style."
+    ),
+    (
+        "analysis_future_prospects",
+        "6. Future prospects",
+        "Future prospects",
+        "Based on the combined insights from the papers above, "
+        "discuss future prospects for this field of research. "
+        "What are upcoming developments, broader impacts, or next steps? Formal academic style."
+    ),
+    (
+        "analysis_research_directions",
+        "7. Potential research directions",
+        "Potential research directions",
+        "Based on the insights from the papers above, "
+        "propose potential research directions for future investigations. "
+        "Stay cohesive and formal in style."
+    ),
+]
+
+
+# "per_section" sends one request per section; "single_call" asks for every
+# section in one JSON response and falls back to per-section requests for
+# any section that comes back missing or malformed.
+REPORT_MODES = ("per_section", "single_call")
+
+# An incremental update reuses a previous report section while the papers it
+# was written from overlap this many of the current ones (Jaccard similarity).
+REPORT_REUSE_SIMILARITY = float(os.getenv("REPER_REPORT_REUSE_SIMILARITY", 0.8))
+
+
+def paper_ids(sub_topics):
+    """The distinct arxiv_ids of a review's papers, sorted."""
+    return sorted({p["arxiv_id"] for papers in sub_topics.values() for p in papers})
+
+
+def jaccard(a, b):
+    a, b = set(a), set(b)
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+
+def reusable_sections(previous, topic, ids, threshold=None):
+    """
+    Sections of the previous run's report that are still current: same
+    topic, and written from a paper set similar enough to ids. Returns
+    {key: (text, paper_ids it was written from)}.
+    """
+    threshold = REPORT_REUSE_SIMILARITY if threshold is None else threshold
+    try:
+        with open(previous.sections_path, encoding="utf-8") as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if saved.get("topic") != topic:
+        return {}
+    return {
+        key: (section["text"], section["paper_ids"])
+        for key, section in saved.get("sections", {}).items()
+        if section.get("text") and jaccard(section["paper_ids"], ids) >= threshold
+    }
+
+
+def single_call_instruction(topic):
+    lines = [
+        "Write every section of this literature review in a single response.",
+        "Return ONLY a JSON object with exactly the keys below, each mapped to the "
+        "section text as a string (Markdown allowed inside the strings, no headings):",
+        "",
+        f'- "abstract": {ABSTRACT_INSTRUCTION.format(topic=topic)}'
+    ]
+    for key, _, _, instruction in ANALYSIS_SECTIONS:
+        lines.append(f'- "{key}": {instruction}')
+    return "\n".join(line.replace("\n", " ") for line in lines)
+
+
+def parse_sections_response(text, keys):
+    """
+    Pull the requested section keys out of a JSON (possibly code-fenced)
+    response. Sections that are missing, empty or not strings are left out.
+    Raw newlines and tabs inside the section strings, which models often
+    emit in long Markdown values, are accepted.
+    """
+    if not text:
+        return {}
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end <= start:
+        return {}
+    try:
+        parsed = json.loads(text[start:end + 1], strict=False)
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(parsed, dict):
+        return {}
+    return {key: parsed[key].strip() for key in keys
+            if isinstance(parsed.get(key), str) and parsed[key].strip()}
+
+
+def generate_sections(agent, section_prompts, max_workers=8, warm_first=False, stream_handler=None):
+    """
+    Run one agent.inference call per (key, label, prompt) through a bounded
+    thread pool. A failing section is logged and left empty without affecting
+    the others. With warm_first, the first section runs on its own so that
+    the provider has cached the shared prompt prefix before the rest fan out.
+
+    With a stream_handler, sections are instead streamed one at a time in the
+    calling thread: stream_handler(key, label, chunks) receives a generator of
+    text deltas and must return the full text (e.g. st.write_stream).
+    Returns ({key: text}, {key: seconds}).
+    """
+    def run(section):
+        key, label, prompt = section
+        started = time.perf_counter()
+        try:
+            if stream_handler is not None:
+                text = stream_handler(key, label, agent.stream_inference(prompt))
+            else:
+                text = agent.inference(prompt)
+        except Exception as e:
+            print(f"{label} generation failed: {e}")
+            text = ""
+        return key, text, time.perf_counter() - started
+
+    results, timings = {}, {}
+    outcomes = []
+    pending = list(section_prompts)
+    if warm_first and max_workers > 1 and len(pending) > 1:
+        outcomes.append(run(pending.pop(0)))
+    if max_workers <= 1 or stream_handler is not None:
+        outcomes.extend(run(section) for section in pending)
+    elif pending:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(pending))) as executor:
+            outcomes.extend(executor.map(wrap(run), pending))
+
+    for key, text, elapsed in outcomes:
+        results[key] = text
+        timings[key] = round(elapsed, 3)
+        print(f"  Section '{key}' generated in {elapsed:.1f}s")
+    return results, timings
+
+
+def generate_literature_report(open_ai_key=None, base_url=None, max_workers=8, context_token_budget=None,
+                               warm_prefix_cache=True, mode="per_section", stream_handler=None, data=None, run=None,
+                               previous=None):
     # -----------------------
-    # 0) Load data from JSON
+    # 0) Load data from the run's JSON, unless the review is passed in memory
     # -----------------------
-    try:
-        with open("database/literature_data.json") as f:
-            data = json.load(f)
-    except Exception as e:
-        print(f"Failed to load data: {e}")
-        return
+    run = run or RunContext.legacy()
+    if data is None:
+        try:
+            with open(run.data_path) as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"Failed to load data: {e}")
+            return
 
     # Instantiate the PostdocAgent with provided API key and base_url
     postdoc_agent = PostdocAgent(
@@ -42,19 +249,7 @@ def generate_literature_report(open_ai_key=None, base_url=None):
     }
 
     # -----------------------
-    # 1) Generate Abstract
-    # -----------------------
-    try:
-        report_content["sections"]["abstract"] = postdoc_agent.inference(
-            f"Generate an abstract for a single, cohesive literature review on: {data['metadata']['research_topic']}.\n"
-            "Avoid dividing the abstract by sub-topics, just provide a general overview.\n"
-            "Write in a formal academic style."
-        )
-    except Exception as e:
-        print(f"Abstract generation failed: {e}")
-
-    # -----------------------
-    # 2) Sub-topics as a Numbered List
+    # 1) Sub-topics as a Numbered List
     # -----------------------
     subtopic_names = list(data["sub_topics"].keys())
     if not subtopic_names:
@@ -66,102 +261,66 @@ def generate_literature_report(open_ai_key=None, base_url=None):
     report_content["sections"]["subtopics_list"] = subtopic_list_str
 
     # -----------------------
-    # 3) Gather All Papers
+    # 2) Gather All Papers (deduplicated, compact, within the token budget)
     # -----------------------
-    all_papers = []
-    for _, papers in data["sub_topics"].items():
-        all_papers.extend(papers)
-    papers_json_str = json.dumps(all_papers, indent=2)
+    papers_json_str = build_paper_context(
+        data["sub_topics"], token_budget=context_token_budget)
+    print(f"Paper context: ~{count_tokens(papers_json_str)} tokens per prompt")
 
     # -----------------------
-    # 4) Generate Literature Analysis (Seven Headings)
+    # 3) Generate Abstract and Literature Analysis (Seven Headings) concurrently
     # -----------------------
-    try:
-        prompt_subtopics = (
-            f"You are a senior researcher discussing sub-topics as they appear in the following papers:\n\n"
-            f"{papers_json_str}\n\n"
-            "Discuss how these sub-topics arise collectively across the studies in an integrated manner.\n"
-            "Do NOT create separate headings for each sub-topic. Instead, weave them into a unified narrative.\n"
-            "Write in a formal academic style."
-        )
-        report_content["sections"]["analysis_subtopics"] = postdoc_agent.inference(
-            prompt_subtopics)
-    except Exception as e:
-        print(f"Sub-topics analysis generation failed: {e}")
+    topic = data['metadata']['research_topic']
+    prefix = CORPUS_PREFIX.format(topic=topic, papers=papers_json_str)
+    section_prompts = [
+        ("abstract", "Abstract", prefix + ABSTRACT_INSTRUCTION.format(topic=topic))]
+    for key, _, label, instruction in ANALYSIS_SECTIONS:
+        section_prompts.append((key, label, prefix + instruction))
 
-    try:
-        prompt_methodologies = (
-            "Analyze the key methodologies used across all of these papers:\n\n"
-            f"{papers_json_str}\n\n"
-            "Discuss them in a unified manner (no separate sub-topic headings). "
-            "Focus on experimental setups, data handling, analysis techniques, etc., in formal academic style."
-        )
-        report_content["sections"]["analysis_methodologies"] = postdoc_agent.inference(
-            prompt_methodologies)
-    except Exception as e:
-        print(f"Key methodologies generation failed: {e}")
+    # An update of an earlier run only regenerates the sections whose papers
+    # changed meaningfully; each keeps the paper set it was written from, so
+    # small changes add up until they cross the threshold.
+    ids = paper_ids(data["sub_topics"])
+    reused = reusable_sections(previous, topic, ids) if previous is not None else {}
+    if reused:
+        section_prompts = [section for section in section_prompts if section[0] not in reused]
+        print(f"  Reusing {len(reused)} sections of run '{previous.run_id}'"
+              + (f"; regenerating {len(section_prompts)}" if section_prompts else ""))
+    bases = {key: basis for key, (_, basis) in reused.items()}
+    results = {key: text for key, (text, _) in reused.items()}
 
-    try:
-        prompt_findings = (
-            "Analyze the major findings from the following papers:\n\n"
-            f"{papers_json_str}\n\n"
-            "Synthesize the findings into one cohesive discussion. "
-            "Highlight common themes or unique results. Write in formal academic style."
-        )
-        report_content["sections"]["analysis_findings"] = postdoc_agent.inference(
-            prompt_findings)
-    except Exception as e:
-        print(f"Major findings generation failed: {e}")
+    if mode not in REPORT_MODES:
+        raise ValueError(f"Unknown report mode: {mode}")
+    timings = {}
+    if mode == "single_call" and section_prompts:
+        started = time.perf_counter()
+        try:
+            response = postdoc_agent.inference(
+                prefix + single_call_instruction(topic))
+        except Exception as e:
+            print(f"Single-call report generation failed: {e}")
+            response = ""
+        timings["single_call"] = round(time.perf_counter() - started, 3)
+        results.update(parse_sections_response(
+            response, [key for key, _, _ in section_prompts]))
+        section_prompts = [
+            section for section in section_prompts if section[0] not in results]
+        print(f"  Single call returned {len(results) - len(reused)} sections in {timings['single_call']:.1f}s"
+              + (f"; regenerating {len(section_prompts)} individually" if section_prompts else ""))
 
-    try:
-        prompt_limitations = (
-            "Discuss the limitations identified across the following papers:\n\n"
-            f"{papers_json_str}\n\n"
-            "Unify them into a single discussion, referencing typical constraints, possible biases, and other weaknesses. "
-            "Write in a formal academic style."
-        )
-        report_content["sections"]["analysis_limitations"] = postdoc_agent.inference(
-            prompt_limitations)
-    except Exception as e:
-        print(f"Limitations generation failed: {e}")
-
-    try:
-        prompt_relationships = (
-            "Discuss how these papers relate to each other and to broader research in the field:\n\n"
-            f"{papers_json_str}\n\n"
-            "Highlight interconnections, differences, or complementary findings. Formal academic style."
-        )
-        report_content["sections"]["analysis_relationships"] = postdoc_agent.inference(
-            prompt_relationships)
-    except Exception as e:
-        print(f"Relationships generation failed: {e}")
-
-    try:
-        prompt_future = (
-            "Based on the combined insights from these papers:\n\n"
-            f"{papers_json_str}\n\n"
-            "Discuss future prospects for this field of research. "
-            "What are upcoming developments, broader impacts, or next steps? Formal academic style."
-        )
-        report_content["sections"]["analysis_future_prospects"] = postdoc_agent.inference(
-            prompt_future)
-    except Exception as e:
-        print(f"Future prospects generation failed: {e}")
-
-    try:
-        prompt_research_dirs = (
-            "Based on the insights from these papers:\n\n"
-            f"{papers_json_str}\n\n"
-            "Propose potential research directions for future investigations. "
-            "Stay cohesive and formal in style."
-        )
-        report_content["sections"]["analysis_research_directions"] = postdoc_agent.inference(
-            prompt_research_dirs)
-    except Exception as e:
-        print(f"Potential research directions generation failed: {e}")
+    # The first section goes on its own to warm the provider's prefix cache,
+    # unless the single call already did.
+    fallback_results, fallback_timings = generate_sections(
+        postdoc_agent, section_prompts, max_workers=max_workers,
+        warm_first=warm_prefix_cache and mode == "per_section", stream_handler=stream_handler)
+    results.update(fallback_results)
+    timings.update(fallback_timings)
+    report_content["sections"].update(results)
+    report_content["timings"] = timings
+    report_content["reused_sections"] = sorted(reused)
 
     # -----------------------
-    # 5) Generate References
+    # 4) Generate References
     # -----------------------
     try:
         for papers in data["sub_topics"].values():
@@ -172,7 +331,7 @@ def generate_literature_report(open_ai_key=None, base_url=None):
         print(f"Reference generation failed: {e}")
 
     # -----------------------
-    # 6) Build Final Markdown
+    # 5) Build Final Markdown
     # -----------------------
     md_content = (
         f"# {report_content['title']}\n"
@@ -182,35 +341,35 @@ def generate_literature_report(open_ai_key=None, base_url=None):
         "## Sub-topics (Numbered List)\n"
         f"{report_content['sections']['subtopics_list']}\n\n"
         "## Literature Analysis\n"
-        "### 1. Sub-topics\n"
-        f"{report_content['sections']['analysis_subtopics']}\n\n"
-        "### 2. Key methodologies\n"
-        f"{report_content['sections']['analysis_methodologies']}\n\n"
-        "### 3. Major findings\n"
-        f"{report_content['sections']['analysis_findings']}\n\n"
-        "### 4. Limitations\n"
-        f"{report_content['sections']['analysis_limitations']}\n\n"
-        "### 5. Relationships to other studies\n"
-        f"{report_content['sections']['analysis_relationships']}\n\n"
-        "### 6. Future prospects\n"
-        f"{report_content['sections']['analysis_future_prospects']}\n\n"
-        "### 7. Potential research directions\n"
-        f"{report_content['sections']['analysis_research_directions']}\n\n"
-        "## References\n"
     )
+    for key, heading, _, _ in ANALYSIS_SECTIONS:
+        md_content += (
+            f"### {heading}\n"
+            f"{report_content['sections'][key]}\n\n"
+        )
+    md_content += "## References\n"
     sorted_references = sorted(report_content["sections"]["references"])
     md_content += "\n".join(sorted_references)
 
     # -----------------------
-    # 7) Save to File
+    # 6) Save to File
     # -----------------------
     try:
-        with open("database/literature_review_report.md", "w") as f:
-            f.write(md_content)
+        run.ensure()
+        write_file(run.report_path, md_content)
+        write_file(run.sections_path, json.dumps({
+            "topic": topic,
+            "sections": {
+                key: {"text": results[key], "paper_ids": bases.get(key, ids)}
+                for key in results if results[key]
+            }
+        }))
         print("\n=== Single integrated report with all seven sections generated successfully ===")
     except Exception as e:
         print(f"Failed to save final report: {e}")
 
+    return report_content
+
 
 if __name__ == "__main__":
     generate_literature_report()
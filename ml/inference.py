@@ -1,33 +1,313 @@
 # inference.py
 
-from openai import OpenAI
 import os
+import random
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from email.utils import parsedate_to_datetime
 from dotenv import load_dotenv
+from prompt_context import count_tokens
+from telemetry import record, record_usage
 
 load_dotenv()
 
+DEFAULT_BASE_URL = "https://generativelanguage.googleapis.com/v1beta/openai/"
 
-def query_model(model_str, system_prompt, prompt, temp, openai_api_key=None, base_url=None):
-    client = OpenAI(
-        api_key=openai_api_key if openai_api_key else os.getenv("OPENAI_API_KEY"),
-        base_url=base_url if base_url else "https://generativelanguage.googleapis.com/v1beta/openai/"
+# Retries are handled here (see _create_with_retries), not by the SDK.
+MAX_RETRIES = int(os.getenv("REPER_LLM_MAX_RETRIES", 4))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+
+# Optional secondary endpoint used once the primary one has given up.
+FALLBACK_MODEL = os.getenv("OPENAI_FALLBACK_MODEL")
+FALLBACK_BASE_URL = os.getenv("OPENAI_FALLBACK_BASE_URL")
+FALLBACK_API_KEY = os.getenv("OPENAI_FALLBACK_API_KEY")
+
+# Clients are keyed on (api_key, base_url) and reused for the lifetime of the
+# process so that their HTTP connection pools (and TLS sessions) stay warm.
+# OpenAI clients are safe to share between threads.
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _client_key(openai_api_key=None, base_url=None):
+    return (
+        openai_api_key if openai_api_key else os.getenv("OPENAI_API_KEY"),
+        base_url if base_url else DEFAULT_BASE_URL
     )
 
-    print("OpenAI API Key:", openai_api_key)
-    print("Base URL:", base_url)
 
-    messages = [
+def get_client(openai_api_key=None, base_url=None):
+    """
+    Return the shared OpenAI client for this api key / base URL pair,
+    creating it on first use.
+    """
+    api_key, url = key = _client_key(openai_api_key, base_url)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            # Imported on first use: the SDK alone takes most of a second.
+            from openai import OpenAI
+            client = OpenAI(api_key=api_key, base_url=url, max_retries=0)
+            _clients[key] = client
+    return client
+
+
+def close_clients():
+    """Close every pooled client."""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at per_minute / 60 per second. reserve() takes the
+    amount immediately, letting the level go negative, and returns how long
+    the caller has to wait before its share has actually been earned.
+    """
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount):
+        with self._lock:
+            now = time.monotonic()
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+            self.updated = now
+            self.level -= amount
+            return max(0.0, -self.level / self.rate)
+
+
+class LLMRateLimiter:
+    """
+    Client-side limits for one endpoint: requests per minute, tokens per
+    minute (0 disables either) and a cap on concurrent calls, all taken
+    through slot() by every request to the endpoint; a streamed request
+    keeps its slot until the whole stream has been read.
+    """
+
+    def __init__(self, rpm=0, tpm=0, max_concurrency=8):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.semaphore = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+
+    def reserve(self, estimated_tokens):
+        """Take one request and the estimated tokens; returns the seconds to wait."""
+        delay = 0.0
+        if self.requests is not None:
+            delay = max(delay, self.requests.reserve(1))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.reserve(estimated_tokens))
+        return delay
+
+    def settle(self, estimated_tokens, completion):
+        """Correct the token reservation once the real usage is known."""
+        usage = getattr(completion, "usage", None)
+        if self.tokens is not None and usage is not None:
+            self.tokens.reserve(usage.total_tokens - estimated_tokens)
+
+    @contextmanager
+    def slot(self, estimated_tokens):
+        delay = self.reserve(estimated_tokens)
+        if delay:
+            time.sleep(delay)
+        if self.semaphore is None:
+            yield
+            return
+        with self.semaphore:
+            yield
+
+
+_rate_limiters = {}
+_rate_limit_settings = {
+    "rpm": int(os.getenv("REPER_LLM_RPM", 0)),
+    "tpm": int(os.getenv("REPER_LLM_TPM", 0)),
+    "max_concurrency": int(os.getenv("REPER_LLM_MAX_CONCURRENCY", 8)),
+}
+
+
+def configure_rate_limits(rpm=None, tpm=None, max_concurrency=None):
+    """Change the limits applied to every endpoint from now on."""
+    with _clients_lock:
+        for name, value in (("rpm", rpm), ("tpm", tpm), ("max_concurrency", max_concurrency)):
+            if value is not None:
+                _rate_limit_settings[name] = value
+        _rate_limiters.clear()
+
+
+def get_rate_limiter(base_url=None):
+    url = base_url or DEFAULT_BASE_URL
+    with _clients_lock:
+        limiter = _rate_limiters.get(url)
+        if limiter is None:
+            limiter = _rate_limiters[url] = LLMRateLimiter(**_rate_limit_settings)
+    return limiter
+
+
+def _is_retryable(error):
+    import openai
+
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def _retry_delay(error, attempt):
+    """Honour Retry-After when the server sends it; otherwise exponential backoff with full jitter."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    retry_after_ms = headers.get("retry-after-ms")
+    retry_after = headers.get("retry-after")
+    try:
+        if retry_after_ms is not None:
+            return min(float(retry_after_ms) / 1000, BACKOFF_MAX * 4)
+        if retry_after is not None:
+            return min(float(retry_after), BACKOFF_MAX * 4)
+    except ValueError:
+        try:
+            wait = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            return min(max(wait, 0.0), BACKOFF_MAX * 4)
+        except (TypeError, ValueError):
+            pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def _targets(model_str, openai_api_key, base_url):
+    """
+    The primary (model, key, base URL), then the configured fallback, if any.
+    The primary key is only reused on the primary URL: a fallback on another
+    provider needs OPENAI_FALLBACK_API_KEY, so the key never leaks to it.
+    """
+    targets = [(model_str, openai_api_key, base_url)]
+    if not (FALLBACK_MODEL or FALLBACK_BASE_URL):
+        return targets
+    fallback_url = FALLBACK_BASE_URL or base_url
+    if (fallback_url or DEFAULT_BASE_URL) != (base_url or DEFAULT_BASE_URL) and not FALLBACK_API_KEY:
+        return targets
+    targets.append((
+        FALLBACK_MODEL or model_str,
+        FALLBACK_API_KEY or openai_api_key,
+        fallback_url
+    ))
+    return targets
+
+
+def _create_with_retries(model_str, messages, temp, openai_api_key=None, base_url=None, **kwargs):
+    """
+    chat.completions.create under the endpoint's rate limits, retrying
+    429s, timeouts, connection errors and 5xx responses, then failing over
+    to the fallback endpoint. Raises the last error if every attempt fails.
+
+    With stream=True, create() returns once the headers arrive, so this
+    returns (stream, slot) instead: the limiter slot stays held until the
+    caller closes slot after reading the stream.
+    """
+    estimated_tokens = sum(count_tokens(m["content"]) for m in messages)
+    last_error = None
+    for target, (model, api_key, url) in enumerate(_targets(model_str, openai_api_key, base_url)):
+        if target:
+            record(failovers=1)
+            print(f"Failing over to {model} at {url or DEFAULT_BASE_URL}")
+        client = get_client(api_key, url)
+        limiter = get_rate_limiter(url)
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                with ExitStack() as slot:
+                    slot.enter_context(limiter.slot(estimated_tokens))
+                    completion = client.chat.completions.create(
+                        model=model, messages=messages, temperature=temp, **kwargs)
+                    if kwargs.get("stream"):
+                        return completion, slot.pop_all()
+                limiter.settle(estimated_tokens, completion)
+                return completion
+            except Exception as e:
+                last_error = e
+                if not _is_retryable(e) or attempt == MAX_RETRIES:
+                    break
+                delay = _retry_delay(e, attempt)
+                record(retries=1)
+                print(f"API Error ({e.__class__.__name__}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+    raise last_error
+
+
+def _build_messages(system_prompt, prompt):
+    return [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": prompt}
     ]
 
+
+def _log_usage(model_str, completion):
+    """Print token usage, including prompt tokens served from the provider's prefix cache."""
+    usage = getattr(completion, "usage", None)
+    if usage is None:
+        return
+    record_usage(model_str, usage)
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    print(f"Usage ({model_str}): prompt={usage.prompt_tokens} "
+          f"(cached={cached}) completion={usage.completion_tokens}")
+
+
+def query_model(model_str, system_prompt, prompt, temp, openai_api_key=None, base_url=None):
+    print("OpenAI API Key:", openai_api_key)
+    print("Base URL:", base_url)
+
+    messages = _build_messages(system_prompt, prompt)
+
     try:
-        completion = client.chat.completions.create(
-            model=model_str,
-            messages=messages,
-            temperature=temp
-        )
+        completion = _create_with_retries(
+            model_str, messages, temp, openai_api_key, base_url)
+        _log_usage(model_str, completion)
         return completion.choices[0].message.content
     except Exception as e:
         print(f"API Error: {str(e)}")
         return ""
+
+
+def stream_model(model_str, system_prompt, prompt, temp, openai_api_key=None, base_url=None):
+    """
+    Streaming form of query_model: yields the response text delta by delta.
+    Closing the generator early (e.g. the user aborts) closes the HTTP stream.
+    Errors are retried only until the stream has started. Once text has been
+    yielded, an error, or a stream that ends without a finish_reason or usage
+    chunk, is raised so that callers never mistake partial text for a full
+    response. Usage is requested as a final chunk so that streamed calls are
+    metered like the others; backends that ignore the option end with a
+    finish_reason alone.
+    """
+    messages = _build_messages(system_prompt, prompt)
+
+    started = finished = False
+    try:
+        stream, slot = _create_with_retries(
+            model_str, messages, temp, openai_api_key, base_url,
+            stream=True, stream_options={"include_usage": True})
+        # The endpoint's concurrency slot is held until the stream is done.
+        with slot, stream:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    started = True
+                    yield chunk.choices[0].delta.content
+                if chunk.choices and chunk.choices[0].finish_reason:
+                    finished = True
+                if getattr(chunk, "usage", None) is not None:
+                    finished = True
+                    _log_usage(model_str, chunk)
+    except Exception as e:
+        if started:
+            raise
+        print(f"API Error: {str(e)}")
+        return
+    if started and not finished:
+        raise ConnectionError("Stream ended before the response was complete")
@@ -0,0 +1,271 @@
+# jobs.py
+
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from contextlib import closing
+from run_context import DATABASE_DIR, RunContext, new_run_id
+from singleflight import coalesce_key
+
+JOBS_DB = os.path.join(DATABASE_DIR, "jobs.sqlite")
+
+# Parameters that must not outlive the job; they are wiped once it ends.
+SECRET_PARAMS = ("open_ai_key",)
+
+ACTIVE_STATUSES = ("queued", "running")
+
+# How often an idle worker looks for running jobs whose worker has died.
+ORPHAN_CHECK_SECONDS = float(os.getenv("REPER_ORPHAN_CHECK_SECONDS", 30))
+
+
+class JobQueue:
+    """
+    SQLite-backed queue of review jobs. A job's ID doubles as its run ID, so
+    its files end up in the matching RunContext directory. Each method opens
+    its own connection, which makes the queue safe to use from any thread or
+    process.
+    """
+
+    def __init__(self, path=JOBS_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY,"
+                " params TEXT NOT NULL,"
+                " secrets TEXT,"
+                " status TEXT NOT NULL,"
+                " stages TEXT NOT NULL DEFAULT '{}',"
+                " timings TEXT NOT NULL DEFAULT '{}',"
+                " run_dir TEXT,"
+                " error TEXT,"
+                " worker_pid INTEGER,"
+                " created_at REAL NOT NULL,"
+                " started_at REAL,"
+                " finished_at REAL)"
+            )
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "dedupe_key" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN dedupe_key TEXT")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_dedupe ON jobs (dedupe_key, status)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def enqueue(self, params):
+        """
+        Queue a run_workflow call with these keyword arguments; returns the job
+        ID. If an identical request (see singleflight.coalesce_key) is already
+        queued or running, its job ID is returned instead of adding a new job;
+        a running one whose worker has died is put back in the queue first.
+        """
+        job_id = new_run_id()
+        dedupe_key = coalesce_key(params)
+        public = {k: v for k, v in params.items() if k not in SECRET_PARAMS}
+        secrets = {k: v for k, v in params.items() if k in SECRET_PARAMS}
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            existing = conn.execute(
+                "SELECT id, status, worker_pid FROM jobs WHERE dedupe_key = ? AND status IN (?, ?) "
+                "ORDER BY created_at LIMIT 1",
+                (dedupe_key,) + ACTIVE_STATUSES
+            ).fetchone()
+            if existing is not None:
+                if existing["status"] == "running" and not _pid_alive(existing["worker_pid"]):
+                    self._requeue(conn, existing["id"], existing["worker_pid"])
+                    print(f"Requeued job {existing['id']}: its worker is gone")
+                conn.execute("COMMIT")
+                print(f"Attaching to in-flight job {existing['id']}")
+                return existing["id"]
+            conn.execute(
+                "INSERT INTO jobs (id, params, secrets, status, run_dir, created_at, dedupe_key) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, json.dumps(public), json.dumps(secrets),
+                 RunContext(job_id).directory, time.time(), dedupe_key)
+            )
+            conn.execute("COMMIT")
+        return job_id
+
+    def claim(self, worker_pid):
+        """Atomically take the oldest queued job; returns (job_id, params) or None."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, params, secrets FROM jobs WHERE status = 'queued' "
+                "ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker_pid = ?, started_at = ? WHERE id = ?",
+                (worker_pid, time.time(), row["id"])
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        params = json.loads(row["params"])
+        params.update(json.loads(row["secrets"] or "{}"))
+        return row["id"], params
+
+    def update_stage(self, job_id, stage, status):
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            stages = json.loads(conn.execute(
+                "SELECT stages FROM jobs WHERE id = ?", (job_id,)).fetchone()["stages"])
+            stages[stage] = status
+            conn.execute("UPDATE jobs SET stages = ? WHERE id = ?",
+                         (json.dumps(stages), job_id))
+            conn.execute("COMMIT")
+
+    def finish(self, job_id, status, timings=None, error=None):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, timings = ?, error = ?, secrets = NULL, "
+                "finished_at = ? WHERE id = ?",
+                (status, json.dumps(timings or {}), error, time.time(), job_id)
+            )
+
+    def get(self, job_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job.pop("secrets")
+        for field in ("params", "stages", "timings"):
+            job[field] = json.loads(job[field])
+        return job
+
+    def requeue_orphans(self):
+        """Put running jobs whose worker process no longer exists back in the queue."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT id, worker_pid FROM jobs WHERE status = 'running'").fetchall()
+            for row in rows:
+                if not _pid_alive(row["worker_pid"]):
+                    self._requeue(conn, row["id"], row["worker_pid"])
+
+    @staticmethod
+    def _requeue(conn, job_id, worker_pid):
+        # Matching on the dead worker's pid leaves the job alone if another
+        # process has already requeued it and a new worker has claimed it.
+        conn.execute(
+            "UPDATE jobs SET status = 'queued', worker_pid = NULL, stages = '{}' "
+            "WHERE id = ? AND status = 'running' AND worker_pid IS ?", (job_id, worker_pid))
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def run_job(queue, job_id, params):
+    # Imported here so that the queue itself stays cheap to import for the UI.
+    from pipeline import run_workflow
+
+    try:
+        outcome = run_workflow(
+            **params,
+            run=RunContext(job_id),
+            on_stage=lambda name, status: queue.update_stage(job_id, name, status)
+        )
+        failed = not outcome["results"].get("review")
+        queue.finish(job_id, "failed" if failed else "done", outcome["timings"],
+                     "Literature review failed." if failed else None)
+    except Exception as e:
+        traceback.print_exc()
+        queue.finish(job_id, "failed", error=str(e))
+
+
+def worker_loop(db_path, poll_interval=1.0, metrics_port=None):
+    if metrics_port is not None:
+        from telemetry import start_metrics_server
+        start_metrics_server(metrics_port)
+    queue = JobQueue(db_path)
+    pid = os.getpid()
+    last_orphan_check = time.monotonic()
+    while True:
+        job = queue.claim(pid)
+        if job is None:
+            # Jobs left running by a worker that crashed since the pool started.
+            if time.monotonic() - last_orphan_check >= ORPHAN_CHECK_SECONDS:
+                queue.requeue_orphans()
+                last_orphan_check = time.monotonic()
+            time.sleep(poll_interval)
+            continue
+        run_job(queue, *job)
+
+
+class WorkerPool:
+    """
+    Fixed number of worker processes pulling jobs from a JobQueue. The
+    pool size bounds how many reviews run at once on this machine.
+    """
+
+    def __init__(self, db_path=JOBS_DB, workers=None):
+        self.db_path = db_path
+        self.workers = workers or int(os.getenv("REPER_JOB_WORKERS", 2))
+        self.processes = []
+        self._lock = threading.Lock()
+
+    def _spawn(self, i):
+        # spawn, not fork: the parent (e.g. the Streamlit server) runs threads.
+        context = multiprocessing.get_context("spawn")
+        # Each worker serves its own metrics on the ports after REPER_METRICS_PORT.
+        metrics_port = os.getenv("REPER_METRICS_PORT")
+        process = context.Process(
+            target=worker_loop,
+            args=(self.db_path, 1.0, int(metrics_port) + 1 + i if metrics_port else None),
+            name=f"reper-worker-{i}", daemon=True)
+        process.start()
+        return process
+
+    def start(self):
+        JobQueue(self.db_path).requeue_orphans()
+        with self._lock:
+            self.processes = [self._spawn(i) for i in range(self.workers)]
+        return self
+
+    def ensure_workers(self):
+        """Replace workers that have died and requeue the jobs they were running."""
+        with self._lock:
+            dead = [i for i, process in enumerate(self.processes) if not process.is_alive()]
+            if not dead:
+                return 0
+            JobQueue(self.db_path).requeue_orphans()
+            for i in dead:
+                print(f"Restarting {self.processes[i].name} "
+                      f"(exit code {self.processes[i].exitcode})")
+                self.processes[i] = self._spawn(i)
+        return len(dead)
+
+    def stop(self):
+        with self._lock:
+            for process in self.processes:
+                process.terminate()
+            for process in self.processes:
+                process.join()
+            self.processes = []
@@ -1,11 +1,13 @@
 # literature_review.py
 
-import os
 import re
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from tools import ArxivSearch
+from tools import ArxivSearch, Paper
 from agents import SubTopicAgent
+from run_context import RunContext
+from telemetry import wrap, write_file
 
 
 def extract_sub_topics(text):
@@ -30,6 +32,7 @@ def extract_sub_topics(text):
 def extract_paper_metadata(paper):
     """
     Convert a raw paper info string into a dict with title, arxiv_id, published, summary, link.
+    Only needed for the legacy text form; Paper.metadata() gives the same dict directly.
     """
     try:
         return {
@@ -44,29 +47,92 @@ def extract_paper_metadata(paper):
         return None
 
 
-def perform_literature_review(research_topic, start_year, end_year, max_count=50, open_ai_key=None, base_url=None):
+def fetch_sub_topic_papers(arxiv_engine, sub_topics, start_year, end_year, N=100, max_workers=4, since=None):
     """
-    Perform a literature review:
-      1. Generate sub-topics (via SubTopicAgent).
-      2. Determine how many papers per sub-topic, so total does not exceed max_count.
-      3. For each sub-topic, fetch papers (filtered by date) and collect up to that limit.
-      4. Save results to literature_data.json.
+    Run the arXiv search for every sub-topic, up to max_workers at a time.
+    The engine's shared rate limiter keeps the workers within arXiv's
+    politeness delay. With since, only papers submitted after it are fetched.
+    Returns one entry per sub-topic, in sub-topic order: either the list of
+    Paper records or the exception raised by the search.
     """
-    print(f"\n=== Starting Literature Review: {research_topic} ===")
-    print(
-        f"Date Range: {start_year}-{end_year}, Max total papers: {max_count}\n")
+    def search(st):
+        try:
+            return arxiv_engine.find_papers(
+                query=st,
+                start_year=start_year,
+                end_year=end_year,
+                N=N,
+                since=since
+            )
+        except Exception as e:
+            return e
 
-    # Base structure for the final JSON
-    report = {
-        "metadata": {
-            "research_topic": research_topic,
-            "generated_at": datetime.now().isoformat(),
-            "source": "arXiv"
-        },
-        "sub_topics": {}
-    }
+    if max_workers <= 1 or len(sub_topics) <= 1:
+        return [search(st) for st in sub_topics]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(sub_topics))) as executor:
+        # map() yields in submission order, so the merge stays deterministic.
+        return list(executor.map(wrap(search), sub_topics))
+
+
+def load_review(run):
+    """The literature_data.json of an earlier run, or None if it has none."""
+    try:
+        with open(run.data_path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"No previous review to update in '{run.directory}': {e}")
+        return None
+
+
+def merge_prior_papers(prior, sub_topics, search_results, start_year, end_year):
+    """
+    Put each sub-topic's papers from the prior review in front of the newly
+    fetched ones, dropping duplicates by arxiv_id and prior papers outside
+    the year range. A failed search keeps just the prior papers, so an
+    update never loses what the review already had.
+    """
+    merged = []
+    for st, new in zip(sub_topics, search_results):
+        kept = [Paper.from_dict(p) for p in prior["sub_topics"].get(st, [])
+                if start_year <= int(p["published"][:4]) <= end_year]
+        if isinstance(new, Exception):
+            print(f"  Update search failed for sub-topic '{st}', keeping its previous papers: {new}")
+            merged.append(kept)
+            continue
+        seen = {p.arxiv_id for p in kept}
+        merged.append(kept + [p for p in new if p.arxiv_id not in seen])
+    return merged
+
+
+def rank_sub_topic_papers(arxiv_engine, research_topic, sub_topics, search_results, top_k):
+    """
+    Replace each successful search result with its top_k papers by embedding
+    relevance, ranking every sub-topic in one batched pass. Failed searches
+    are passed through untouched; if ranking fails, arXiv order is kept.
+    """
+    candidates = [(st, papers) for st, papers in zip(sub_topics, search_results)
+                  if not isinstance(papers, Exception)]
+    if not any(papers for _, papers in candidates):
+        return search_results
 
-    # 1) Generate Sub-Topics
+    try:
+        print("Ranking candidate papers by relevance...")
+        selected = arxiv_engine.select_top_papers(
+            research_topic, candidates, top_k)
+    except Exception as e:
+        print(f"Ranking failed, keeping arXiv order: {e}")
+        return search_results
+
+    return [selected.get(st, papers) if not isinstance(papers, Exception) else papers
+            for st, papers in zip(sub_topics, search_results)]
+
+
+def generate_sub_topics(research_topic, open_ai_key=None, base_url=None):
+    """
+    Ask the SubTopicAgent for 5-7 sub-topics of the research topic.
+    Returns the list of sub-topics, or None if none could be identified.
+    """
     try:
         print("Generating sub-topics...")
         sub_agent = SubTopicAgent(
@@ -81,10 +147,67 @@ def perform_literature_review(research_topic, start_year, end_year, max_count=50
             return None
 
         print(f"Identified sub-topics:\n  " + "\n  ".join(sub_topics))
+        return sub_topics
     except Exception as e:
         print(f"Failed to generate sub-topics: {e}")
         return None
 
+
+def perform_literature_review(research_topic, start_year, end_year, max_count=50, open_ai_key=None, base_url=None,
+                              max_workers=4, rank=True, retrieval_mode="live", sub_topics=None, run=None,
+                              arxiv_engine=None, previous=None):
+    """
+    Perform a literature review:
+      1. Generate sub-topics (via SubTopicAgent), unless they are passed in.
+      2. Determine how many papers per sub-topic, so total does not exceed max_count.
+      3. Fetch papers (filtered by date) for all sub-topics concurrently, using up to
+         max_workers threads (1 = serial). retrieval_mode "hybrid" answers from the
+         local paper index first and "offline" never contacts arXiv. An
+         arxiv_engine passed in is used as is (retrieval_mode is then ignored).
+      4. If rank is set, keep each sub-topic's most relevant papers by embedding
+         similarity (otherwise arXiv's order), and collect up to that limit for each.
+      5. Save results to literature_data.json in the run's directory
+         (database/ when no RunContext is given).
+
+    Given the RunContext of an earlier review as previous, the review is
+    updated instead: its sub-topics are reused, arXiv is only asked for
+    papers submitted since its generated_at, and those are merged with its
+    papers by arxiv_id before ranking. Without ranking, the previous papers
+    keep their places and new ones only fill free slots. If previous has no
+    review, a full one is run.
+    """
+    run = run or RunContext.legacy()
+    prior = load_review(previous) if previous is not None else None
+    since = prior["metadata"]["generated_at"] if prior else None
+    print(f"\n=== {'Updating' if prior else 'Starting'} Literature Review: {research_topic} ===")
+    print(
+        f"Date Range: {start_year}-{end_year}, Max total papers: {max_count}\n")
+
+    # Base structure for the final JSON
+    report = {
+        "metadata": {
+            "research_topic": research_topic,
+            "generated_at": datetime.now().isoformat(),
+            "source": "arXiv",
+            "run_id": run.run_id
+        },
+        "sub_topics": {}
+    }
+    if prior:
+        report["metadata"]["updated_from"] = {
+            "run_id": prior["metadata"].get("run_id"),
+            "generated_at": since
+        }
+        print(f"Fetching only papers submitted since {since}\n")
+
+    # 1) Generate Sub-Topics (an update keeps the previous ones)
+    if not sub_topics and prior:
+        sub_topics = list(prior["sub_topics"])
+    if not sub_topics:
+        sub_topics = generate_sub_topics(research_topic, open_ai_key, base_url)
+        if not sub_topics:
+            return None
+
     # 2) Decide how many papers per sub-topic
     sub_topic_count = len(sub_topics)
     papers_per_subtopic = max_count // sub_topic_count  # integer division
@@ -94,45 +217,54 @@ def perform_literature_review(research_topic, start_year, end_year, max_count=50
     print(
         f"\nWe have {sub_topic_count} sub-topics. Each sub-topic will collect up to {papers_per_subtopic} papers.\n")
 
-    arxiv_engine = ArxivSearch()
+    arxiv_engine = arxiv_engine or ArxivSearch(retrieval_mode=retrieval_mode)
+
+    # 3) Fetch every sub-topic at once
+    search_results = fetch_sub_topic_papers(
+        arxiv_engine,
+        sub_topics,
+        start_year,
+        end_year,
+        N=100,  # large enough to find papers_per_subtopic
+        max_workers=max_workers,
+        since=since
+    )
+
+    # 4) Rank, then collect up to papers_per_subtopic for each sub-topic
+    found_counts = [0 if isinstance(papers, Exception) else len(papers)
+                    for papers in search_results]
+    if prior:
+        search_results = merge_prior_papers(prior, sub_topics, search_results, start_year, end_year)
+    if rank:
+        search_results = rank_sub_topic_papers(
+            arxiv_engine, research_topic, sub_topics, search_results, papers_per_subtopic)
 
-    # 3) For each sub-topic, collect up to papers_per_subtopic
-    for idx, st in enumerate(sub_topics, 1):
+    for idx, (st, papers, found) in enumerate(zip(sub_topics, search_results, found_counts), 1):
         print(f"Processing sub-topic {idx}/{sub_topic_count}: {st}")
         report["sub_topics"][st] = []
 
-        try:
-            raw_papers = arxiv_engine.find_papers_by_str(
-                query=st,
-                start_year=start_year,
-                end_year=end_year,
-                N=100  # large enough to find papers_per_subtopic
-            )
-            papers = raw_papers.split("\n\n")
-            print(f"  Found {len(papers)} papers (post date-filter).")
-        except Exception as e:
-            print(f"  Paper search failed for sub-topic '{st}': {e}")
+        if isinstance(papers, Exception):
+            print(f"  Paper search failed for sub-topic '{st}': {papers}")
             continue
+        print(f"  Found {found} {'new ' if prior else ''}papers (post date-filter).")
+        if not papers:
+            print("    Did not find any paper in between the dates")
+
+        # Collect up to papers_per_subtopic
+        for collected, paper in enumerate(papers[:papers_per_subtopic], 1):
+            report["sub_topics"][st].append(paper.metadata())
+            print(f"    Added paper {collected}: {paper.title}")
+
+    if prior:
+        prior_ids = {p["arxiv_id"] for papers in prior["sub_topics"].values() for p in papers}
+        new_ids = {p["arxiv_id"] for papers in report["sub_topics"].values() for p in papers} - prior_ids
+        report["metadata"]["new_papers"] = len(new_ids)
+        print(f"\n{len(new_ids)} new papers added to the review.")
 
-        # Now parse and collect up to papers_per_subtopic
-        collected = 0
-        for paper_str in papers:
-            if collected >= papers_per_subtopic:
-                break
-
-            paper_data = extract_paper_metadata(paper_str)
-            if paper_data:
-                report["sub_topics"][st].append(paper_data)
-                collected += 1
-                print(f"    Added paper {collected}: {paper_data['title']}")
-            else:
-                print("    Did not find any paper in between the dates")
-
-    # 4) Save final JSON
+    # 5) Save final JSON
     try:
-        os.makedirs("database", exist_ok=True)
-        with open("database/literature_data.json", "w") as f:
-            json.dump(report, f, indent=2)
+        run.ensure()
+        write_file(run.data_path, json.dumps(report, indent=2))
         print("\n=== Data collection completed successfully ===")
     except Exception as e:
         print(f"\nFailed to save results: {e}")
@@ -1,9 +1,9 @@
 # main.py
 import os
 import logging
-from literature_review import perform_literature_review
-import generate_report
-import novel_ideas
+from pipeline import run_workflow
+from run_context import RunContext
+from singleflight import SingleFlight, coalesce_key
 
 # Configure logging
 logging.basicConfig(
@@ -12,6 +12,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Identical reviews requested at the same time share a single run.
+_in_flight = SingleFlight()
+
 def main(
     research_topic: str,
     max_value: int,
@@ -20,10 +23,17 @@ def main(
     start_year: int = None,
     end_year: int = None,
     generate_report_flag: bool = True,
-    generate_novel_approach_flag: bool = True
+    generate_novel_approach_flag: bool = True,
+    report_mode: str = "per_section",
+    run: RunContext = None,
+    previous_run_dir: str = None
 ):
     """
-    Main function to perform literature review workflow.
+    Main function to perform literature review workflow. Stages run
+    concurrently as soon as their inputs are ready; returns the pipeline
+    outcome with per-stage results, status and timings. A call identical to
+    one already in flight in this process waits for it and returns its
+    outcome (and run) instead of repeating the work.
     
     Args:
         research_topic (str): The research topic to analyze
@@ -34,35 +44,41 @@ def main(
         end_year (int, optional): End year for paper search
         generate_report_flag (bool): Whether to generate literature report
         generate_novel_approach_flag (bool): Whether to generate novel approach
+        report_mode (str): "per_section" (one request per section) or "single_call"
+        run (RunContext, optional): Where to store this run's files; a new
+            run under database/runs/ is created when omitted
+        previous_run_dir (str, optional): Directory of an earlier run of the
+            same topic to update incrementally instead of starting over
     """
     try:
-        logger.info("Starting literature review...")
-        literature_data = perform_literature_review(
-            research_topic,
-            start_year,
-            end_year,
-            max_count=max_value,
+        logger.info("Starting literature review workflow...")
+        params = dict(
+            research_topic=research_topic,
+            max_value=max_value,
             open_ai_key=open_ai_key,
-            base_url=base_url
+            base_url=base_url,
+            start_year=start_year,
+            end_year=end_year,
+            generate_report_flag=generate_report_flag,
+            generate_novel_approach_flag=generate_novel_approach_flag,
+            report_mode=report_mode,
+            previous_run_dir=previous_run_dir
         )
-        
-        if not literature_data:
+        outcome = _in_flight.do(coalesce_key(params), lambda: run_workflow(
+            **params,
+            run=run,
+            on_stage=lambda name, status: logger.info(f"Stage '{name}': {status}")
+        ))
+
+        logger.info(f"Run {outcome['run'].run_id} stored in {outcome['run'].directory}")
+        for stage, seconds in outcome["timings"].items():
+            logger.info(f"Stage '{stage}' took {seconds:.1f}s")
+
+        if not outcome["results"].get("review"):
             logger.error("Literature review failed. Exiting workflow.")
             return
 
-        if generate_report_flag:
-            logger.info("Generating literature report...")
-            generate_report.generate_literature_report(
-                open_ai_key=open_ai_key,
-                base_url=base_url
-            )
-
-        if generate_novel_approach_flag:
-            logger.info("Proposing novel research approach...")
-            novel_ideas.propose_novel_approach_and_save(
-                open_ai_key=open_ai_key,
-                base_url=base_url
-            )
+        return outcome
 
     except Exception as e:
         logger.error(f"An error occurred: {str(e)}")
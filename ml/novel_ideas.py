@@ -1,19 +1,53 @@
 import json
 from agents import NovelApproachAgent
+from run_context import RunContext
+from telemetry import write_file
 
 
-def propose_novel_approach_and_save(open_ai_key=None, base_url=None):
+APPROACH_HEADING = "**Proposed Approach**:\n\n"
+
+
+def previous_approach(previous, data):
     """
-    1. Load literature data from JSON.
-    2. Call the NovelApproachAgent to propose a new research direction.
-    3. Save the resulting approach as Markdown.
+    The approach saved by the previous run, if that run had the same topic
+    and sub-topics (the only inputs of the prompt); otherwise None.
     """
     try:
-        with open("database/literature_data.json", "r") as f:
-            data = json.load(f)
-    except Exception as e:
-        print(f"Failed to load literature data: {e}")
-        return
+        with open(previous.data_path, encoding="utf-8") as f:
+            prior = json.load(f)
+        with open(previous.novel_approach_path, encoding="utf-8") as f:
+            md_content = f.read()
+    except (OSError, ValueError):
+        return None
+    if (prior["metadata"]["research_topic"] != data["metadata"]["research_topic"]
+            or list(prior["sub_topics"]) != list(data["sub_topics"])
+            or APPROACH_HEADING not in md_content):
+        return None
+    return md_content.split(APPROACH_HEADING, 1)[1].rstrip("\n") or None
+
+
+def propose_novel_approach_and_save(open_ai_key=None, base_url=None, stream_handler=None, data=None, run=None,
+                                    previous=None):
+    """
+    1. Load literature data from JSON, unless it is passed in. Only the
+       research topic and the sub-topic names are used, so a review whose
+       sub-topics are known but whose papers are still being fetched will do.
+    2. Call the NovelApproachAgent to propose a new research direction.
+       With a stream_handler, the response is streamed through
+       stream_handler(key, label, chunks), which returns the full text.
+    3. Save the resulting approach as Markdown in the run's directory
+       (database/ when no RunContext is given).
+    When updating the run previous, its approach is reused as long as the
+    topic and sub-topics are unchanged.
+    """
+    run = run or RunContext.legacy()
+    if data is None:
+        try:
+            with open(run.data_path, "r") as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"Failed to load literature data: {e}")
+            return
 
     prompt = (
         "Below is the literature review data.\n\n"
@@ -32,23 +66,32 @@ def propose_novel_approach_and_save(open_ai_key=None, base_url=None):
         base_url=base_url
     )
 
-    novel_approach = novel_agent.inference(prompt=prompt)
+    novel_approach = previous_approach(previous, data) if previous is not None else None
+    if novel_approach is not None:
+        print(f"Reusing the novel approach of run '{previous.run_id}'")
+    elif stream_handler is not None:
+        novel_approach = stream_handler(
+            "novel_approach", "Novel research approach", novel_agent.stream_inference(prompt))
+    else:
+        novel_approach = novel_agent.inference(prompt=prompt)
 
     md_content = (
         f"# Novel Research Approach\n\n"
         f"**Topic**: {data['metadata']['research_topic']}\n\n"
-        f"**Proposed Approach**:\n\n"
+        f"{APPROACH_HEADING}"
         f"{novel_approach}\n"
     )
 
-    output_file = "database/novel_approach.md"
+    output_file = run.novel_approach_path
     try:
-        with open(output_file, "w", encoding="utf-8") as f:
-            f.write(md_content)
+        run.ensure()
+        write_file(output_file, md_content)
         print(f"Novel approach saved successfully to '{output_file}'!")
     except Exception as e:
         print(f"Failed to save novel approach: {e}")
 
+    return novel_approach
+
 
 if __name__ == "__main__":
     propose_novel_approach_and_save()
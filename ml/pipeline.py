@@ -0,0 +1,170 @@
+# pipeline.py
+
+import asyncio
+import functools
+import time
+from literature_review import generate_sub_topics, load_review, perform_literature_review
+import generate_report
+import novel_ideas
+from run_context import RunContext
+from telemetry import span, trace_run, wrap
+
+
+class Stage:
+    """
+    One step of the workflow. func receives a dict mapping each dependency's
+    name to its result. A stage whose dependency failed or returned None is
+    skipped.
+    """
+
+    def __init__(self, name, func, deps=()):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+
+
+async def run_stages(stages, on_stage=None, concurrent=True):
+    """
+    Run the stages as a DAG: each one starts as soon as all of its
+    dependencies have finished, and independent stages run at the same time
+    on worker threads. Stages must be listed after their dependencies.
+    With concurrent=False every stage runs in the calling thread, one after
+    another, in the order given.
+
+    on_stage(name, status) is called from the calling thread with "running",
+    "done", "skipped" or "failed". Returns {"results", "status", "timings"}.
+    """
+    loop = asyncio.get_running_loop()
+    tasks = {}
+    results, status, timings = {}, {}, {}
+
+    def report(name, state):
+        status[name] = state
+        if on_stage is not None:
+            on_stage(name, state)
+
+    async def run(stage):
+        inputs = {}
+        for dep in stage.deps:
+            if dep in tasks:
+                await asyncio.wait([tasks[dep]])
+            if status.get(dep) != "done" or results.get(dep) is None:
+                report(stage.name, "skipped")
+                return
+            inputs[dep] = results[dep]
+
+        report(stage.name, "running")
+        started = time.perf_counter()
+        try:
+            with span("stage", stage=stage.name):
+                if concurrent:
+                    # run_in_executor does not carry the context over; wrap()
+                    # keeps the stage's spans under this one.
+                    result = await loop.run_in_executor(
+                        None, functools.partial(wrap(stage.func), inputs))
+                else:
+                    result = stage.func(inputs)
+        except Exception as e:
+            print(f"Stage '{stage.name}' failed: {e}")
+            results[stage.name] = e
+            report(stage.name, "failed")
+            return
+        finally:
+            timings[stage.name] = round(time.perf_counter() - started, 3)
+        results[stage.name] = result
+        report(stage.name, "done")
+
+    for stage in stages:
+        if concurrent:
+            tasks[stage.name] = asyncio.ensure_future(run(stage))
+        else:
+            await run(stage)
+    if tasks:
+        await asyncio.gather(*tasks.values())
+    return {"results": results, "status": status, "timings": timings}
+
+
+def _sub_topics(research_topic, open_ai_key, base_url, previous):
+    prior = load_review(previous) if previous is not None else None
+    if prior and prior["sub_topics"]:
+        return list(prior["sub_topics"])
+    return generate_sub_topics(research_topic, open_ai_key, base_url)
+
+
+def build_workflow(research_topic, max_value, open_ai_key=None, base_url=None, start_year=None, end_year=None,
+                   generate_report_flag=True, generate_novel_approach_flag=True, report_mode="per_section",
+                   stream_handler=None, run=None, previous=None, arxiv_engine=None):
+    """
+    The review workflow as stages, all writing into the run's directory.
+    The review and report pass their data in memory; the novel approach only
+    needs the sub-topic names, so it starts as soon as they exist instead of
+    waiting for the papers and report. With previous (an earlier run), every
+    stage updates that run's results instead of starting from scratch.
+    An arxiv_engine is shared with other workflows (e.g. in a batch).
+    """
+    run = run or RunContext()
+    stages = [
+        Stage("sub_topics", lambda inputs: _sub_topics(
+            research_topic, open_ai_key, base_url, previous)),
+        Stage("review", lambda inputs: perform_literature_review(
+            research_topic,
+            start_year,
+            end_year,
+            max_count=max_value,
+            open_ai_key=open_ai_key,
+            base_url=base_url,
+            sub_topics=inputs["sub_topics"],
+            run=run,
+            previous=previous,
+            arxiv_engine=arxiv_engine
+        ), deps=["sub_topics"]),
+    ]
+    if generate_report_flag:
+        stages.append(Stage("report", lambda inputs: generate_report.generate_literature_report(
+            open_ai_key=open_ai_key,
+            base_url=base_url,
+            mode=report_mode,
+            stream_handler=stream_handler,
+            data=inputs["review"],
+            run=run,
+            previous=previous
+        ), deps=["review"]))
+    if generate_novel_approach_flag:
+        stages.append(Stage("novel_approach", lambda inputs: novel_ideas.propose_novel_approach_and_save(
+            open_ai_key=open_ai_key,
+            base_url=base_url,
+            stream_handler=stream_handler,
+            data={
+                "metadata": {"research_topic": research_topic},
+                "sub_topics": {st: [] for st in inputs["sub_topics"]}
+            },
+            run=run,
+            previous=previous
+        ), deps=["sub_topics"]))
+    return stages
+
+
+def run_workflow(research_topic, max_value, open_ai_key=None, base_url=None, start_year=None, end_year=None,
+                 generate_report_flag=True, generate_novel_approach_flag=True, report_mode="per_section",
+                 stream_handler=None, on_stage=None, concurrent=True, run=None, previous_run_dir=None,
+                 arxiv_engine=None):
+    """
+    Run the whole workflow in its own RunContext (a new one unless given) and
+    return {"results", "status", "timings", "run"}. Its spans are written to
+    the run's trace.jsonl.
+    A stream_handler writes to the caller's UI, so it requires concurrent=False.
+    previous_run_dir makes this an incremental update of that earlier run:
+    only papers submitted since it are fetched, and its report sections and
+    novel approach are kept while their inputs are (nearly) unchanged.
+    """
+    if stream_handler is not None and concurrent:
+        raise ValueError("stream_handler requires concurrent=False")
+    run = run or RunContext()
+    stages = build_workflow(
+        research_topic, max_value, open_ai_key, base_url, start_year, end_year,
+        generate_report_flag, generate_novel_approach_flag, report_mode, stream_handler, run,
+        RunContext.from_directory(previous_run_dir) if previous_run_dir else None, arxiv_engine)
+    with trace_run(run), span("workflow", run_id=run.run_id, research_topic=research_topic):
+        outcome = asyncio.run(run_stages(stages, on_stage=on_stage, concurrent=concurrent))
+    outcome["run"] = run
+    return outcome
@@ -0,0 +1,108 @@
+# prompt_context.py
+
+import json
+import os
+import re
+
+# Upper bound on the tokens spent on the paper corpus in a single prompt.
+DEFAULT_TOKEN_BUDGET = int(os.getenv("REPER_CONTEXT_TOKEN_BUDGET", 30000))
+
+_encoding = None
+
+
+def count_tokens(text):
+    """
+    Token count using tiktoken when it is installed; otherwise the usual
+    four-characters-per-token estimate, which is close enough for budgeting.
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def _first_sentences(text, n=2):
+    sentences = re.split(r"(?<=[.!?])\s+", text)
+    return " ".join(sentences[:n])
+
+
+def collect_papers(sub_topics):
+    """
+    Deduplicate the papers of every sub-topic by arxiv_id, most relevant
+    first. A paper's relevance is its best position in any sub-topic list
+    (those lists are already ranked), ties broken by how many sub-topics
+    it appears under. Each entry also lists the sub-topics it belongs to.
+    """
+    papers = {}
+    for st, st_papers in sub_topics.items():
+        for position, paper in enumerate(st_papers):
+            entry = papers.get(paper["arxiv_id"])
+            if entry is None:
+                entry = papers[paper["arxiv_id"]] = {
+                    "paper": paper, "position": position, "sub_topics": []}
+            entry["position"] = min(entry["position"], position)
+            entry["sub_topics"].append(st)
+    ordered = sorted(
+        papers.values(), key=lambda e: (e["position"], -len(e["sub_topics"])))
+    return [
+        {
+            "arxiv_id": e["paper"]["arxiv_id"],
+            "title": e["paper"]["title"],
+            "published": e["paper"]["published"],
+            "sub_topics": e["sub_topics"],
+            "summary": " ".join(e["paper"]["summary"].split())
+        }
+        for e in ordered
+    ]
+
+
+def _serialize(paper):
+    return json.dumps(paper, separators=(",", ":"), ensure_ascii=False)
+
+
+def build_paper_context(sub_topics, token_budget=None):
+    """
+    Compact, deduplicated paper corpus for the report prompts: one JSON
+    object per line, no indentation and no links. When the corpus exceeds
+    token_budget, summaries are shortened to their first sentences and then
+    dropped, least relevant papers first; papers are only left out entirely
+    when even titles alone don't fit.
+    """
+    token_budget = token_budget or DEFAULT_TOKEN_BUDGET
+    papers = collect_papers(sub_topics)
+    lines = [_serialize(p) for p in papers]
+    costs = [count_tokens(line) for line in lines]
+    total = sum(costs)
+
+    for shorten in (_first_sentences, lambda summary: None):
+        for i in reversed(range(len(papers))):
+            if total <= token_budget:
+                break
+            paper = dict(papers[i])
+            summary = shorten(paper["summary"])
+            if summary is None:
+                paper.pop("summary")
+            elif summary == paper["summary"]:
+                continue
+            else:
+                paper["summary"] = summary
+            papers[i] = paper
+            lines[i] = _serialize(paper)
+            total -= costs[i]
+            costs[i] = count_tokens(lines[i])
+            total += costs[i]
+
+    while lines and total > token_budget:
+        total -= costs.pop()
+        lines.pop()
+
+    if len(lines) < len(papers):
+        print(f"Paper context trimmed to {len(lines)}/{len(papers)} papers "
+              f"to fit {token_budget} tokens.")
+    return "\n".join(lines)
@@ -0,0 +1,67 @@
+# run_context.py
+
+import os
+import uuid
+from datetime import datetime
+
+DATABASE_DIR = "database"
+RUNS_DIR = os.path.join(DATABASE_DIR, "runs")
+
+
+def new_run_id():
+    return f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+
+
+class RunContext:
+    """
+    Identity and storage namespace of one review run. Every file a run
+    reads or writes lives in its own directory, so concurrent runs (e.g.
+    two Streamlit sessions) never overwrite each other.
+    """
+
+    DATA_FILE = "literature_data.json"
+    REPORT_FILE = "literature_review_report.md"
+    NOVEL_APPROACH_FILE = "novel_approach.md"
+    # Report section texts and the paper IDs each was written from, so that
+    # an incremental update can tell which sections are still current.
+    SECTIONS_FILE = "report_sections.json"
+
+    def __init__(self, run_id=None, root=RUNS_DIR, directory=None):
+        self.run_id = run_id or new_run_id()
+        self.directory = directory or os.path.join(root, self.run_id)
+
+    @classmethod
+    def legacy(cls):
+        """The shared database/ directory used when no run is given."""
+        return cls(run_id="default", directory=DATABASE_DIR)
+
+    @classmethod
+    def from_directory(cls, directory):
+        """An existing run, identified by its directory."""
+        return cls(run_id=os.path.basename(os.path.normpath(directory)), directory=directory)
+
+    def path(self, file_name):
+        return os.path.join(self.directory, file_name)
+
+    @property
+    def data_path(self):
+        return self.path(self.DATA_FILE)
+
+    @property
+    def report_path(self):
+        return self.path(self.REPORT_FILE)
+
+    @property
+    def novel_approach_path(self):
+        return self.path(self.NOVEL_APPROACH_FILE)
+
+    @property
+    def sections_path(self):
+        return self.path(self.SECTIONS_FILE)
+
+    def ensure(self):
+        os.makedirs(self.directory, exist_ok=True)
+        return self
+
+    def __repr__(self):
+        return f"RunContext({self.run_id!r}, directory={self.directory!r})"
@@ -0,0 +1,65 @@
+# singleflight.py
+
+import hashlib
+import json
+import threading
+
+# Workflow parameters that change the result. The API key is deliberately
+# left out: identical reviews are shared whoever's key pays for them.
+COALESCE_PARAMS = (
+    "research_topic", "max_value", "start_year", "end_year", "base_url",
+    "generate_report_flag", "generate_novel_approach_flag", "report_mode",
+    "previous_run_dir",
+)
+
+
+def coalesce_key(params):
+    """Stable key for a workflow request, ignoring case and spacing in the topic."""
+    normalized = {name: params.get(name) for name in COALESCE_PARAMS}
+    normalized["research_topic"] = " ".join(
+        str(normalized["research_topic"] or "").lower().split())
+    payload = json.dumps(normalized, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Deduplicate concurrent calls: while fn is running for a key, further
+    do() calls with the same key wait for it and share its result (or its
+    exception) instead of running fn again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            print(f"Attaching to in-flight request {key[:12]}...")
+            call.done.wait()
+        else:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
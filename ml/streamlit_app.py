@@ -2,10 +2,16 @@ import streamlit as st
 import os
 import json
 import base64
-from literature_review import perform_literature_review
+import html
+import math
+import time
 import generate_report
-import novel_ideas
-import torch
+from pipeline import run_workflow
+from run_context import RUNS_DIR, RunContext
+from jobs import JobQueue, WorkerPool, ACTIVE_STATUSES
+from singleflight import SingleFlight, coalesce_key
+from tools import warm_up_embedder
+from telemetry import start_metrics_server
 
 # Disable dynamic imports and set Streamlit configuration
 st.set_page_config(
@@ -45,27 +51,221 @@ try:
 except Exception as e:
     st.warning(f"Error loading CSS: {str(e)}")
 
-# Initialize torch
-torch.classes.__path__ = []
+@st.cache_resource
+def start_embedder_warm_up():
+    # Runs once per server process; set REPER_WARM_UP_EMBEDDER=1 to load the
+    # ranking model in the background before the first review needs it.
+    if os.getenv("REPER_WARM_UP_EMBEDDER", "").lower() in ("1", "true", "yes"):
+        return warm_up_embedder()
+    return None
 
 
-def load_result_files(db_folder="database"):
-    result_files = {}
-    if os.path.exists(db_folder):
-        for file_name in os.listdir(db_folder):
-            file_path = os.path.join(db_folder, file_name)
-            try:
-                with open(file_path, "r", encoding="utf-8", errors="replace") as f:
-                    result_files[file_name] = f.read()
-            except Exception as e:
-                st.error(f"Error reading {file_name}: {e}")
-    return result_files
+start_embedder_warm_up()
+
+
+@st.cache_resource
+def start_metrics_endpoint():
+    # Prometheus metrics for runs executed in this process; job workers serve
+    # their own on the following ports. Off unless REPER_METRICS_PORT is set.
+    return start_metrics_server()
+
+
+start_metrics_endpoint()
+
+
+RESULT_MIME_TYPES = {".json": "application/json", ".md": "text/markdown"}
+# The files offered for download; a run directory also holds telemetry and
+# cache files (trace.jsonl, report_sections.json) that are not results.
+RESULT_FILES = (RunContext.DATA_FILE, RunContext.REPORT_FILE, RunContext.NOVEL_APPROACH_FILE)
+PAPERS_PER_PAGE = 10
+
+
+def list_result_files(run_dir="database"):
+    # Paths only: the downloads read the files from disk when they render,
+    # so nothing large is kept in session state between reruns.
+    paths = (os.path.join(run_dir, file_name) for file_name in RESULT_FILES)
+    return [path for path in paths if os.path.isfile(path)]
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def load_papers(data_path, modified):
+    # Keyed by the run's data file and its modification time, so reruns
+    # (e.g. after a download click) don't parse the JSON again.
+    with open(data_path, "r", encoding="utf-8", errors="replace") as f:
+        return json.load(f).get("sub_topics", {})
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def load_run_topic(data_path, modified):
+    with open(data_path, "r", encoding="utf-8", errors="replace") as f:
+        return json.load(f)["metadata"]["research_topic"]
+
+
+def list_previous_runs(root=RUNS_DIR):
+    # Runs with a saved review that a new submission can update, newest
+    # first (run IDs start with their timestamp), as {directory: label}.
+    runs = {}
+    if not os.path.isdir(root):
+        return runs
+    for run_id in sorted(os.listdir(root), reverse=True):
+        data_path = RunContext(run_id, root=root).data_path
+        if not os.path.isfile(data_path):
+            continue
+        try:
+            topic = load_run_topic(data_path, os.path.getmtime(data_path))
+        except Exception:
+            continue
+        runs[os.path.dirname(data_path)] = f"{run_id}: {topic}"
+    return runs
+
+
+def render_paper_card(paper):
+    st.markdown(f"""
+        <div class='paper-card'>
+            <h4 style='color: #2c3e50; margin-bottom: 10px;'>{html.escape(paper.get('title', 'N/A'))}</h4>
+            <p style='color: #34495e;'><strong>Summary:</strong> {html.escape(paper.get('summary', 'N/A'))}</p>
+            <p style='color: #7f8c8d;'><strong>Published:</strong> {html.escape(paper.get('published', 'N/A'))}</p>
+            <a href='{html.escape(paper.get('link', '#'), quote=True)}' target='_blank' style='color: #4CAF50; text-decoration: none;'>🔗 View Paper</a>
+        </div>
+    """, unsafe_allow_html=True)
+
+
+def show_downloads(run_dir):
+    paths = list_result_files(run_dir)
+    if not paths:
+        st.info("No result files available. Please run the workflow to generate files.")
+        return
+    for path in paths:
+        file_name = os.path.basename(path)
+        mime = RESULT_MIME_TYPES.get(os.path.splitext(file_name)[1], "text/plain")
+        with open(path, "rb") as f:
+            st.download_button(
+                label=f"Download {file_name}",
+                data=f,
+                file_name=file_name,
+                mime=mime,
+                key=f"download-{path}"
+            )
+
+
+def show_papers(run_dir):
+    # One sub-topic and one page of cards at a time keeps reruns and the
+    # page itself small, however many papers the review collected.
+    data_path = os.path.join(run_dir, RunContext.DATA_FILE)
+    if not os.path.exists(data_path):
+        st.warning(f"No papers info found in {RunContext.DATA_FILE}.")
+        return
+    try:
+        sub_topics = load_papers(data_path, os.path.getmtime(data_path))
+    except Exception as e:
+        st.error(f"Error reading {RunContext.DATA_FILE}: {e}")
+        return
+    if not sub_topics:
+        st.warning(f"No papers info found in {RunContext.DATA_FILE}.")
+        return
+
+    sub_topic = st.selectbox(
+        "Sub-topic",
+        options=list(sub_topics),
+        format_func=lambda name: f"{name} ({len(sub_topics[name])} papers)",
+        key=f"sub-topic-{run_dir}"
+    )
+    papers = sub_topics[sub_topic]
+    pages = max(1, math.ceil(len(papers) / PAPERS_PER_PAGE))
+    page = 1
+    if pages > 1:
+        page = st.number_input("Page", min_value=1, max_value=pages, value=1, step=1,
+                               key=f"page-{run_dir}-{sub_topic}")
+    first = (page - 1) * PAPERS_PER_PAGE
+    st.markdown(f"### {sub_topic}")
+    for paper in papers[first:first + PAPERS_PER_PAGE]:
+        render_paper_card(paper)
+    if papers:
+        st.caption(f"Papers {first + 1}-{min(first + PAPERS_PER_PAGE, len(papers))} of {len(papers)}")
+    else:
+        st.info("Did not find any paper in between the dates.")
+
+
+JOB_POLL_SECONDS = 2
+
+STAGE_LABELS = {
+    "sub_topics": "Generating sub-topics",
+    "review": "Performing literature review",
+    "report": "Generating literature report",
+    "novel_approach": "Generating novel research approach",
+}
+
+
+def stream_to_page(key, label, chunks):
+    # Render a section as it is generated; returns the full text. Stopping the
+    # app mid-section closes the generator and with it the API stream.
+    st.markdown(f"#### {label}")
+    return st.write_stream(chunks)
+
+
+@st.cache_resource
+def start_job_workers():
+    # One queue and worker pool per server process, shared by all sessions.
+    queue = JobQueue()
+    return queue, WorkerPool(queue.path).start()
+
+
+def get_job_queue():
+    queue, pool = start_job_workers()
+    # Workers that died since the last call (e.g. killed for memory) are
+    # replaced, and their jobs queued again.
+    pool.ensure_workers()
+    return queue
+
+
+@st.cache_resource
+def get_in_flight():
+    # Identical inline reviews submitted from any session share one run.
+    return SingleFlight()
+
+
+def show_stage_messages(params, stage_status, timings):
+    st.success("Literature review completed!")
+    for stage, flag, done_message, skipped_message in (
+        ("report", params["generate_report_flag"],
+         "Literature report generated!", "Skipped literature report generation."),
+        ("novel_approach", params["generate_novel_approach_flag"],
+         "Novel research approach generated!", "Skipped novel research approach generation."),
+    ):
+        if not flag:
+            st.info(skipped_message)
+        elif stage_status.get(stage) == "done":
+            st.success(f"{done_message} ({timings.get(stage, 0):.1f}s)")
+        else:
+            st.error(f"{STAGE_LABELS[stage]} failed. Please check the logs for errors.")
+
+
+def follow_job(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        st.warning(f"Job {job_id} was not found.")
+        st.session_state["loaded_job"] = job_id
+        return
+
+    if job["status"] in ACTIVE_STATUSES:
+        with st.status(f"Job {job_id} is {job['status']}...", expanded=True):
+            for name, state in job["stages"].items():
+                st.write(f"{STAGE_LABELS.get(name, name)}: {state}")
+        time.sleep(JOB_POLL_SECONDS)
+        st.rerun()
+
+    st.session_state["job_id"] = job_id
+    st.session_state["loaded_job"] = job_id
+    if job["status"] == "failed":
+        st.error(f"{job['error'] or 'Job failed.'} Please check the logs for errors.")
+        return
+    show_stage_messages(job["params"], job["stages"], job["timings"])
+    st.session_state["run_dir"] = job["run_dir"]
+    st.session_state["results_generated"] = True
 
 
 def main():
-    # Initialize session state for result files and results_generated flag if not already present.
-    if "result_files" not in st.session_state:
-        st.session_state["result_files"] = {}
+    # Initialize session state for the results_generated flag if not already present.
     if "results_generated" not in st.session_state:
         st.session_state["results_generated"] = False
     if "generate_report_flag" not in st.session_state:
@@ -173,12 +373,34 @@ def main():
             value=True,
             help="Generate a comprehensive literature review report."
         )
+        report_mode = st.selectbox(
+            "Report Mode",
+            options=list(generate_report.REPORT_MODES),
+            help="Generate each report section separately, or all sections in a single request."
+        )
         generate_novel_approach_flag = st.checkbox(
             "Novel Approach",
             value=True,
             help="Generate novel research approaches and ideas."
         )
 
+        previous_runs = list_previous_runs()
+        previous_run_dir = st.selectbox(
+            "Update Previous Review",
+            options=[None] + list(previous_runs),
+            format_func=lambda directory: "No, start a new review" if directory is None
+            else previous_runs[directory],
+            help="Fetch only papers published since that review and merge them in, "
+                 "regenerating report sections only where the papers changed noticeably."
+        )
+
+        stream_output = st.checkbox(
+            "Stream Output",
+            value=False,
+            help="Run in this page and show report sections and the novel approach as they are written. "
+                 "By default the review runs as a background job that survives page reloads."
+        )
+
         # Centered Get Results button
         st.markdown("<br>", unsafe_allow_html=True)
         submit = st.button("Get Results", use_container_width=True)
@@ -187,104 +409,69 @@ def main():
     with st.container():
         if submit:
             # Clean optional inputs
-            open_ai_key = open_ai_key.strip() or None
-            base_url = base_url.strip() or None
-
-            # Run the literature review step
-            with st.spinner("Performing literature review..."):
-                literature_data = perform_literature_review(
-                    research_topic,
-                    start_year,
-                    end_year,
-                    max_count=max_value,
-                    open_ai_key=open_ai_key,
-                    base_url=base_url
-                )
-            if literature_data is None:
-                st.error(
-                    "Literature review failed. Please check the logs for errors.")
-                return
-            st.success("Literature review completed!")
-
-                # Conditionally generate the literature report
-            if generate_report_flag:
-                with st.spinner("Generating literature report..."):
-                    generate_report.generate_literature_report(
-                        open_ai_key=open_ai_key,
-                        base_url=base_url
-                    )
-                st.success("Literature report generated!")
-            else:
-                st.info("Skipped literature report generation.")
-
-            # Conditionally generate the novel research approach
-            if generate_novel_approach_flag:
-                with st.spinner("Generating novel research approach..."):
-                    novel_ideas.propose_novel_approach_and_save(
-                        open_ai_key=open_ai_key,
-                        base_url=base_url
-                    )
-                st.success("Novel research approach generated!")
+            params = dict(
+                research_topic=research_topic,
+                max_value=max_value,
+                open_ai_key=open_ai_key.strip() or None,
+                base_url=base_url.strip() or None,
+                start_year=start_year,
+                end_year=end_year,
+                generate_report_flag=generate_report_flag,
+                generate_novel_approach_flag=generate_novel_approach_flag,
+                report_mode=report_mode,
+                previous_run_dir=previous_run_dir
+            )
+
+            if stream_output:
+                # Streaming renders from this script thread, so the workflow
+                # runs inline with its stages one after another. Each run
+                # gets its own run directory, so sessions don't overwrite each
+                # other's files; a submission identical to one already running
+                # waits for it and shows its results instead.
+                st.session_state["job_id"] = None
+                st.query_params.pop("job", None)
+                with st.status("Running literature review workflow...", expanded=True) as status:
+                    outcome = get_in_flight().do(coalesce_key(params), lambda: run_workflow(
+                        **params,
+                        stream_handler=stream_to_page,
+                        on_stage=lambda name, state: st.write(
+                            f"{STAGE_LABELS[name]}: {state}"),
+                        concurrent=False,
+                        run=RunContext()
+                    ))
+                    st.session_state["run_dir"] = outcome["run"].directory
+                    if not outcome["results"].get("review"):
+                        status.update(label="Literature review failed.", state="error")
+                        st.error(
+                            "Literature review failed. Please check the logs for errors.")
+                        return
+                    status.update(label="Workflow completed!", state="complete")
+
+                show_stage_messages(params, outcome["status"], outcome["timings"])
+                # Set flag to show results
+                st.session_state["results_generated"] = True
             else:
-                st.info("Skipped novel research approach generation.")
+                # Hand the review to the worker pool; the page just polls the
+                # job, which keeps running across reruns and page reloads.
+                job_id = get_job_queue().enqueue(params)
+                st.session_state["job_id"] = job_id
+                st.session_state["results_generated"] = False
+                st.query_params["job"] = job_id
 
-            # Load generated files into session state for persistent download links.
-            st.session_state["result_files"] = load_result_files()
-            # Set flag to show results
-            st.session_state["results_generated"] = True
+        # Follow this session's background job, if any (also after a reload).
+        job_id = st.session_state.get("job_id", st.query_params.get("job"))
+        if job_id and st.session_state.get("loaded_job") != job_id:
+            follow_job(job_id)
 
         # Only show results if they have been generated
         if st.session_state.get("results_generated", False):
             st.markdown("---")
             st.markdown("## Generated Files")
-            if st.session_state["result_files"]:
-                for file_name, file_content in st.session_state["result_files"].items():
-                    # Determine MIME type based on file extension
-                    if file_name.endswith(".json"):
-                        mime = "application/json"
-                    elif file_name.endswith(".md"):
-                        mime = "text/markdown"
-                    else:
-                        mime = "text/plain"
-                    st.download_button(
-                        label=f"Download {file_name}",
-                        data=file_content,
-                        file_name=file_name,
-                        mime=mime
-                    )
-            else:
-                st.info(
-                    "No result files available. Please run the workflow to generate files.")
+            run_dir = st.session_state.get("run_dir", "database")
+            show_downloads(run_dir)
 
             st.markdown("## Papers Information")
-
-            # Read and display papers info from literature_data.json
-            data_file = os.path.join("database", "literature_data.json")
-            if os.path.exists(data_file):
-                try:
-                    with open(data_file, "r", encoding="utf-8", errors="replace") as f:
-                        data = json.load(f)
-                    if "sub_topics" in data:
-                        for sub_topic, papers in data["sub_topics"].items():
-                            st.markdown(f"### {sub_topic}")
-                            total_papers = 0  # Initialize the counter
-                            for paper in papers:
-                                if total_papers >= max_value:
-                                    break
-
-                                st.markdown(f"""
-                                    <div class='paper-card'>
-                                        <h4 style='color: #2c3e50; margin-bottom: 10px;'>{paper.get('title', 'N/A')}</h4>
-                                        <p style='color: #34495e;'><strong>Summary:</strong> {paper.get('summary', 'N/A')}</p>
-                                        <p style='color: #7f8c8d;'><strong>Published:</strong> {paper.get('published', 'N/A')}</p>
-                                        <a href='{paper.get('link', '#')}' target='_blank' style='color: #4CAF50; text-decoration: none;'>🔗 View Paper</a>
-                                    </div>
-                                """, unsafe_allow_html=True)
-                                total_papers += 1
-                except Exception as e:
-                    st.error(f"Error reading literature_data.json: {e}")
-            else:
-                st.warning("No papers info found in literature_data.json.")
+            show_papers(run_dir)
         else:
             st.info("Results will be displayed here once the workflow is complete.")
 
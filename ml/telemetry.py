@@ -0,0 +1,268 @@
+# telemetry.py
+
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TRACE_FILE = "trace.jsonl"
+
+# Counters summed per span name and exported as reper_<name>_total.
+COUNTERS = ("prompt_tokens", "completion_tokens", "cached_tokens", "cache_hits",
+            "bytes_written", "cost_usd")
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Optional USD prices per million tokens, e.g.
+# REPER_LLM_PRICES='{"gemini-2.0-flash": [0.10, 0.40]}' (input, output).
+MODEL_PRICES = json.loads(os.getenv("REPER_LLM_PRICES", "{}"))
+
+# The trace of the run being executed and the innermost open span. Both are
+# context variables, so they follow asyncio tasks automatically; work handed
+# to thread pools must be submitted with copy_context() (see wrap()).
+_current_trace = contextvars.ContextVar("reper_trace", default=None)
+_current_span = contextvars.ContextVar("reper_span", default=None)
+
+
+class Span:
+    def __init__(self, name, parent=None, attrs=None):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attrs = dict(attrs or {})
+        self.start = time.time()
+        self.duration = None
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, **counts):
+        for name, value in counts.items():
+            self.attrs[name] = self.attrs.get(name, 0) + value
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": round(self.start, 6),
+            "duration": round(self.duration, 6),
+            "error": self.error,
+            **self.attrs,
+        }
+
+
+class TraceWriter:
+    """Appends finished spans to a JSONL file, one object per line."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+class Metrics:
+    """
+    Process-wide aggregates of every finished span: a latency histogram,
+    an error count and the COUNTERS, labelled by span name.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans = {}
+
+    def observe(self, span):
+        with self._lock:
+            entry = self._spans.get(span.name)
+            if entry is None:
+                entry = self._spans[span.name] = {
+                    "count": 0, "errors": 0, "seconds": 0.0,
+                    "buckets": [0] * len(LATENCY_BUCKETS),
+                    "counters": dict.fromkeys(COUNTERS, 0),
+                }
+            entry["count"] += 1
+            entry["seconds"] += span.duration
+            if span.error is not None:
+                entry["errors"] += 1
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if span.duration <= bound:
+                    entry["buckets"][i] += 1
+            for name in COUNTERS:
+                value = span.attrs.get(name)
+                if isinstance(value, bool):
+                    value = int(value)
+                if isinstance(value, (int, float)):
+                    entry["counters"][name] += value
+
+    def snapshot(self):
+        with self._lock:
+            return json.loads(json.dumps(self._spans))
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format."""
+        spans = self.snapshot()
+        lines = [
+            "# HELP reper_span_seconds Latency of instrumented operations.",
+            "# TYPE reper_span_seconds histogram",
+        ]
+        for name, entry in sorted(spans.items()):
+            for bound, count in zip(LATENCY_BUCKETS, entry["buckets"]):
+                lines.append(f'reper_span_seconds_bucket{{span="{name}",le="{bound}"}} {count}')
+            lines.append(f'reper_span_seconds_bucket{{span="{name}",le="+Inf"}} {entry["count"]}')
+            lines.append(f'reper_span_seconds_sum{{span="{name}"}} {entry["seconds"]:.6f}')
+            lines.append(f'reper_span_seconds_count{{span="{name}"}} {entry["count"]}')
+        lines += ["# HELP reper_span_errors_total Instrumented operations that raised.",
+                  "# TYPE reper_span_errors_total counter"]
+        for name, entry in sorted(spans.items()):
+            lines.append(f'reper_span_errors_total{{span="{name}"}} {entry["errors"]}')
+        for counter in COUNTERS:
+            lines.append(f"# TYPE reper_{counter}_total counter")
+            for name, entry in sorted(spans.items()):
+                value = entry["counters"][counter]
+                if value:
+                    lines.append(f'reper_{counter}_total{{span="{name}"}} {value:g}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+
+
+METRICS = Metrics()
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Time the enclosed block as a span nested under the current one. The
+    yielded Span takes extra attributes via set()/add(); on exit it is
+    added to METRICS and, inside trace_run(), appended to the run's trace.
+    """
+    current = Span(name, _current_span.get(), attrs)
+    token = _current_span.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{e.__class__.__name__}: {e}"
+        raise
+    finally:
+        current.duration = time.perf_counter() - started
+        _current_span.reset(token)
+        _finish(current)
+
+
+def _finish(current):
+    METRICS.observe(current)
+    trace = _current_trace.get()
+    if trace is not None:
+        try:
+            trace.write(current)
+        except OSError as e:
+            print(f"Failed to write trace: {e}")
+
+
+def record(**counts):
+    """Add counts (tokens, cache hits, ...) to the innermost open span, if any."""
+    current = _current_span.get()
+    if current is not None:
+        current.add(**counts)
+
+
+def record_usage(model_str, usage):
+    """Record an OpenAI usage object, with its cost when the model is priced."""
+    details = getattr(usage, "prompt_tokens_details", None)
+    prompt_tokens = usage.prompt_tokens or 0
+    completion_tokens = usage.completion_tokens or 0
+    counts = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cached_tokens": getattr(details, "cached_tokens", None) or 0,
+    }
+    price = MODEL_PRICES.get(model_str)
+    if price:
+        counts["cost_usd"] = (prompt_tokens * price[0] + completion_tokens * price[1]) / 1e6
+    record(**counts)
+
+
+@contextmanager
+def trace_run(run):
+    """Send the spans of everything run inside the block to run's trace.jsonl."""
+    token = _current_trace.set(TraceWriter(run.path(TRACE_FILE)))
+    try:
+        yield
+    finally:
+        _current_trace.reset(token)
+
+
+def wrap(fn):
+    """
+    Bind fn to the current context, so that spans it opens on a worker
+    thread nest under the submitting span and land in the same trace. Each
+    call runs in its own copy, so the result can be mapped over a pool.
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+
+def write_file(path, content, encoding="utf-8"):
+    """Write text to path inside a file.write span recording the bytes written."""
+    data = content.encode(encoding)
+    with span("file.write", path=path) as s:
+        with open(path, "wb") as f:
+            f.write(data)
+        s.set(bytes_written=len(data))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = METRICS.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_metrics_servers = {}
+_metrics_lock = threading.Lock()
+
+
+def start_metrics_server(port=None, host="127.0.0.1"):
+    """
+    Serve METRICS at http://host:port/metrics from a daemon thread. The port
+    defaults to REPER_METRICS_PORT; returns None when neither is set.
+    Metrics are per process, so every process needs its own port.
+    """
+    if port is None:
+        port = os.getenv("REPER_METRICS_PORT")
+        if not port:
+            return None
+    port = int(port)
+    with _metrics_lock:
+        server = _metrics_servers.get(port)
+        if server is None:
+            try:
+                server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError as e:
+                print(f"Failed to start metrics server on port {port}: {e}")
+                return None
+            threading.Thread(target=server.serve_forever, name="reper-metrics", daemon=True).start()
+            _metrics_servers[port] = server
+    return server
@@ -1,56 +1,406 @@
-import arxiv
-import numpy as np
-from sentence_transformers import SentenceTransformer
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import os
+from cache import get_arxiv_query_cache
+from telemetry import record, span
+
+# arxiv, numpy and the embedding modules (sentence_transformers, torch) are
+# imported where they are first used, so that importing this module (and
+# with it the Streamlit app) stays fast.
+
+
+# arXiv asks API clients to wait at least three seconds between requests.
+ARXIV_POLITENESS_DELAY = 3.0
+
+
+class RateLimiter:
+    """
+    Enforce a minimum interval between calls, shared by every thread that
+    holds a reference to the same limiter.
+    """
+
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        # Reserve the next free slot under the lock, then sleep outside it so
+        # other workers can queue up behind us.
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.min_interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+# Process-wide limiter so that every ArxivSearch respects the delay together.
+ARXIV_RATE_LIMITER = RateLimiter(ARXIV_POLITENESS_DELAY)
+
+DEFAULT_EMBEDDING_MODEL = os.getenv("REPER_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+# MiniLM on CPU is fastest at moderate batches; raise it when running on a GPU.
+RANKING_BATCH_SIZE = int(os.getenv("REPER_RANKING_BATCH_SIZE", 64))
+
+# One SentenceTransformer per model name for the whole process, loaded on
+# first use so that runs which never embed anything don't pay for it.
+_embedders = {}
+_embedders_lock = threading.Lock()
+
+
+def get_embedder(model_name=None):
+    model_name = model_name or DEFAULT_EMBEDDING_MODEL
+    embedder = _embedders.get(model_name)
+    if embedder is None:
+        with _embedders_lock:
+            embedder = _embedders.get(model_name)
+            if embedder is None:
+                from sentence_transformers import SentenceTransformer
+                import torch
+                # Streamlit's file watcher trips over torch.classes' dynamic __path__.
+                torch.classes.__path__ = []
+                embedder = SentenceTransformer(model_name)
+                _embedders[model_name] = embedder
+    return embedder
+
+
+def warm_up_embedder(model_name=None):
+    """Load the embedder on a background thread; returns the thread."""
+    def load():
+        try:
+            get_embedder(model_name)
+        except Exception as e:
+            print(f"Embedder warm-up failed: {e}")
+
+    thread = threading.Thread(target=load, name="embedder-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+@dataclass
+class Paper:
+    """
+    Compact record for one arXiv result. `published` keeps the full ISO
+    timestamp; the text form and the review metadata use its date part.
+    """
+    __slots__ = ("title", "arxiv_id", "published", "summary", "link")
+
+    title: str
+    arxiv_id: str
+    published: str
+    summary: str
+    link: str
+
+    @classmethod
+    def from_result(cls, result):
+        return cls(
+            title=result.title,
+            arxiv_id=result.get_short_id(),
+            published=result.published.isoformat(),
+            summary=result.summary,
+            link=result.entry_id
+        )
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["title"], data["arxiv_id"], data["published"],
+                   data["summary"], data["link"])
+
+    @property
+    def year(self):
+        return int(self.published[:4])
+
+    def to_dict(self):
+        return {
+            "title": self.title,
+            "arxiv_id": self.arxiv_id,
+            "published": self.published,
+            "summary": self.summary,
+            "link": self.link
+        }
+
+    def metadata(self):
+        """The per-paper dict stored in literature_data.json."""
+        return {
+            "title": self.title,
+            "arxiv_id": self.arxiv_id,
+            "published": self.published[:10],
+            "summary": self.summary.strip(),
+            "link": self.link
+        }
+
+    def to_text(self):
+        return (
+            f"Title: {self.title}\n"
+            f"ID: {self.arxiv_id}\n"
+            f"Published: {self.published[:10]}\n"
+            f"Summary: {self.summary}\n"
+            f"Link: {self.link}"
+        )
+
+
+def encode(embedder, texts, **kwargs):
+    """embedder.encode inside an embedding.encode span."""
+    count = 1 if isinstance(texts, str) else len(texts)
+    with span("embedding.encode", texts=count):
+        return embedder.encode(texts, **kwargs)
+
+
+# live: always query arXiv; hybrid: answer from the local paper index and
+# query arXiv only when it has too few hits; offline: local index only.
+RETRIEVAL_MODES = ("live", "hybrid", "offline")
 
 
 class ArxivSearch:
-    def __init__(self):
-        self.client = arxiv.Client()
-        self.embedder = SentenceTransformer('all-MiniLM-L6-v2')
+    def __init__(self, rate_limiter=None, use_cache=True, embedding_model=None,
+                 retrieval_mode="live", min_local_hits=20, min_local_score=0.3, client=None):
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {retrieval_mode}")
+        # Anything with arxiv.Client's results(search) will do, e.g. the
+        # recorded fixtures in benchmarks/arxiv_fixtures.py.
+        if client is None:
+            import arxiv
+            client = arxiv.Client()
+        self.client = client
+        self.embedding_model = embedding_model or DEFAULT_EMBEDDING_MODEL
+        self.rate_limiter = rate_limiter or ARXIV_RATE_LIMITER
+        self.query_cache = get_arxiv_query_cache() if use_cache else None
+        self.retrieval_mode = retrieval_mode
+        self.min_local_hits = min_local_hits
+        self.min_local_score = min_local_score
+
+    @property
+    def embedder(self):
+        return get_embedder(self.embedding_model)
+
+    @property
+    def embedding_store(self):
+        from embedding_store import get_embedding_store
+        return get_embedding_store(self.embedding_model)
+
+    @property
+    def paper_index(self):
+        from vector_index import get_paper_index
+        return get_paper_index(self.embedding_model)
+
+    def find_papers(self, query, start_year, end_year, N=5, since=None):
+        """
+        Return the date-filtered search results as Paper records. With since
+        (an ISO timestamp), only papers submitted after it are fetched, newest
+        first; offline, there is nothing new to find.
+        """
+        with span("arxiv.find_papers", query=query, mode=self.retrieval_mode,
+                  incremental=since is not None) as s:
+            if since is None:
+                papers = self._find_papers(query, start_year, end_year, N)
+            elif self.retrieval_mode == "offline":
+                papers = []
+            else:
+                papers = self._fetch(query, N, since=since)
+                self._remember(papers, embed=self.retrieval_mode == "hybrid")
+                papers = self._filter_by_date(papers, start_year, end_year)
+            s.set(papers=len(papers))
+            return papers
+
+    def _find_papers(self, query, start_year, end_year, N):
+        if self.retrieval_mode == "live":
+            papers = self._search(query, N)
+            self._remember(papers)
+            return self._filter_by_date(papers, start_year, end_year)
+
+        local = self._search_local(query, start_year, end_year, N)
+        if self.retrieval_mode == "offline" or len(local) >= min(N, self.min_local_hits):
+            record(cache_hits=1)
+            return local
+
+        live = self._filter_by_date(self._search(query, N), start_year, end_year)
+        self._remember(live, embed=True)
+        seen = {p.arxiv_id for p in local}
+        return (local + [p for p in live if p.arxiv_id not in seen])[:N]
+
+    def _search_local(self, query, start_year, end_year, N):
+        index = self.paper_index
+        if index is None:
+            return []
+        query_embed = encode(self.embedder, query, normalize_embeddings=True)
+        hits = index.search(query_embed, N, start_year, end_year)
+        return [Paper.from_dict(record) for record, score in hits
+                if score >= self.min_local_score]
+
+    def _remember(self, papers, embed=False):
+        """Add fetched papers to the local index; embedding them makes them searchable."""
+        index = self.paper_index
+        if index is None or not papers:
+            return
+        try:
+            records = [p.to_dict() for p in papers]
+            if embed:
+                index.add(records, self.embedder, batch_size=RANKING_BATCH_SIZE)
+            else:
+                index.add_records(records)
+        except Exception as e:
+            print(f"Failed to update paper index: {e}")
 
     def find_papers_by_str(self, query, start_year, end_year, N=5):
+        """Text form of find_papers, kept for callers that parse strings."""
         try:
+            filtered_results = self.find_papers(query, start_year, end_year, N)
+            return "\n\n".join([self._format_result(p) for p in filtered_results])
+        except Exception as e:
+            print(f"arXiv search failed: {e}")
+            return ""
+
+    def _search(self, query, N):
+        """
+        Return up to N papers for the query as Paper records, served from the query
+        cache while fresh. Stale entries are topped up with only the papers
+        submitted since the newest cached one; those are appended after the
+        cached, relevance-ordered results and push the last of them out, so
+        an entry never holds more than N papers.
+        """
+        if self.query_cache is None:
+            return self._fetch(query, N)
+
+        key = self.query_cache.make_key(query, N, "relevance")
+        entry = self.query_cache.get(key)
+        if entry is None:
+            papers = self._fetch(query, N)
+        else:
+            cached, latest_published, fetched_at = entry
+            cached = [Paper.from_dict(p) for p in cached]
+            if self.query_cache.is_fresh(fetched_at):
+                record(cache_hits=1)
+                return cached[:N]
+            try:
+                newer = self._fetch(query, N, since=latest_published)
+            except Exception as e:
+                print(f"arXiv refresh failed, serving cached results: {e}")
+                return cached[:N]
+            seen = {p.arxiv_id for p in cached}
+            fresh = [p for p in newer if p.arxiv_id not in seen][:N]
+            papers = cached[:N - len(fresh)] + fresh
+
+        self.query_cache.put(key, [p.to_dict() for p in papers])
+        return papers
+
+    def _fetch(self, query, N, since=None):
+        import arxiv
+
+        if since is None:
             search = arxiv.Search(
                 query=f"abs:{query}",
                 max_results=N,
                 sort_by=arxiv.SortCriterion.Relevance
             )
-            results = list(self.client.results(search))
-            filtered_results = self._filter_by_date(
-                results, start_year, end_year)
-            return "\n\n".join([self._format_result(r) for r in filtered_results])
-        except Exception as e:
-            print(f"arXiv search failed: {e}")
-            return ""
+        else:
+            since = datetime.fromisoformat(since).astimezone(timezone.utc)
+            now = datetime.now(timezone.utc)
+            search = arxiv.Search(
+                query=(f"(abs:{query}) AND submittedDate:"
+                       f"[{since:%Y%m%d%H%M} TO {now:%Y%m%d%H%M}]"),
+                max_results=N,
+                sort_by=arxiv.SortCriterion.SubmittedDate
+            )
+        with span("arxiv.fetch", incremental=since is not None) as s:
+            self.rate_limiter.wait()
+            papers = [Paper.from_result(r) for r in self.client.results(search)]
+            s.set(papers=len(papers))
+        return papers
 
     def _filter_by_date(self, results, start_year, end_year):
         filtered_results = []
         for result in results:
-            published_year = result.published.year
+            published_year = result.year
             if start_year <= published_year <= end_year:
                 filtered_results.append(result)
         return filtered_results
 
     def _format_result(self, result):
-        return (
-            f"Title: {result.title}\n"
-            f"ID: {result.get_short_id()}\n"
-            f"Published: {result.published.date()}\n"
-            f"Summary: {result.summary}\n"
-            f"Link: {result.entry_id}"
-        )
+        return result.to_text()
 
     def rank_papers(self, papers, research_topic, top_n=10):
+        """Rank Paper records (or their legacy text form) against the topic."""
         if not papers:
             return []
 
+        import numpy as np
+
         try:
-            topic_embed = self.embedder.encode(research_topic)
-            summaries = [p.split("Summary: ")[1].split("\n")[0]
-                         for p in papers if "Summary: " in p]
-            paper_embeds = self.embedder.encode(summaries)
+            topic_embed = encode(self.embedder, research_topic)
+            store = self.embedding_store
+            if isinstance(papers[0], Paper) and store is not None:
+                topic_embed = topic_embed / np.linalg.norm(topic_embed)
+                paper_embeds = store.encode(
+                    self.embedder,
+                    [p.arxiv_id for p in papers],
+                    [p.summary for p in papers],
+                    batch_size=RANKING_BATCH_SIZE
+                )
+            elif isinstance(papers[0], Paper):
+                paper_embeds = encode(self.embedder, [p.summary for p in papers])
+            else:
+                summaries = [p.split("Summary: ")[1].split("\n")[0]
+                             for p in papers if "Summary: " in p]
+                paper_embeds = encode(self.embedder, summaries)
             scores = np.dot(paper_embeds, topic_embed)
             return [papers[i] for i in np.argsort(scores)[-top_n:]]
         except Exception as e:
             print(f"Ranking failed: {e}")
             return papers[:top_n]
+
+    def select_top_papers(self, research_topic, candidates, top_k, batch_size=None, topic_weight=0.3):
+        """
+        Rank each sub-topic's candidate papers and keep the top_k, best first.
+
+        candidates is a list of (sub_topic, [Paper]) pairs. The topic, every
+        sub-topic and every distinct candidate summary not already in the
+        embedding store are embedded in a single batched encode call; each
+        paper is scored by cosine similarity to its sub-topic, blended with
+        its similarity to the overall topic. Returns {sub_topic: [Paper]}.
+        """
+        from vector_index import top_k_indices
+
+        batch_size = batch_size or RANKING_BATCH_SIZE
+        sub_topics = [st for st, _ in candidates]
+
+        # Papers often show up under several sub-topics; embed each only once.
+        row_of = {}
+        summary_of = {}
+        for _, papers in candidates:
+            for p in papers:
+                if p.arxiv_id not in row_of:
+                    row_of[p.arxiv_id] = len(row_of)
+                    summary_of[p.arxiv_id] = p.summary
+        ids = list(row_of)
+
+        store = self.embedding_store
+        to_encode = store.lookup(ids)[1] if store is not None else ids
+
+        embeds = encode(
+            self.embedder,
+            [research_topic] + sub_topics + [summary_of[i] for i in to_encode],
+            batch_size=batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True
+        )
+        topic_embed = embeds[0]
+        sub_topic_embeds = embeds[1:1 + len(sub_topics)]
+        if store is not None:
+            store.add(to_encode, embeds[1 + len(sub_topics):])
+            paper_embeds = store.get(ids)
+        else:
+            paper_embeds = embeds[1 + len(sub_topics):]
+
+        selected = {}
+        for i, (st, papers) in enumerate(candidates):
+            if not papers:
+                selected[st] = []
+                continue
+            rows = paper_embeds[[row_of[p.arxiv_id] for p in papers]]
+            scores = ((1 - topic_weight) * (rows @ sub_topic_embeds[i])
+                      + topic_weight * (rows @ topic_embed))
+            selected[st] = [papers[j] for j in top_k_indices(scores, top_k)]
+        return selected
@@ -0,0 +1,181 @@
+# vector_index.py
+
+import json
+import os
+import sqlite3
+import threading
+import numpy as np
+from cache import CACHE_DIR, cache_disabled
+from embedding_store import get_embedding_store
+
+# Below this many papers a flat scan is already a few milliseconds, so the
+# inverted-file partitioning only kicks in for larger collections.
+IVF_MIN_PAPERS = 5000
+
+
+def top_k_indices(scores, k):
+    """Indices of the k highest scores, best first, without sorting them all."""
+    if k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def _spherical_kmeans(vectors, n_lists, iterations=10, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)]
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(n_lists):
+            members = vectors[assign == c]
+            if len(members):
+                centroid = members.sum(axis=0)
+                centroids[c] = centroid / (np.linalg.norm(centroid) or 1)
+    return centroids
+
+
+class PaperIndex:
+    """
+    Approximate nearest-neighbour index over every paper the system has
+    fetched. Paper records live in SQLite; their abstract vectors come from
+    the EmbeddingStore, so a paper becomes searchable once it has been
+    embedded (e.g. by the ranking stage). Small collections are scanned
+    flat; larger ones use an IVF partitioning trained with spherical k-means
+    and probed n_probe lists at a time. The partitioning is rebuilt in
+    memory when a process first searches and extended as papers are added.
+    """
+
+    def __init__(self, model_name, path=None, n_probe=8):
+        self.model_name = model_name
+        self.path = path or os.path.join(CACHE_DIR, "paper_index.sqlite")
+        self.n_probe = n_probe
+        self.store = get_embedding_store(model_name)
+        self._lock = threading.Lock()
+
+        self._ids = []
+        self._row_of = {}
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+        self._years = np.empty(0, dtype=np.int32)
+        self._centroids = None
+        self._assign = np.empty(0, dtype=np.int64)
+        self._trained_n = 0
+        self._seen_counts = None
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(
+            self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS papers ("
+            " arxiv_id TEXT PRIMARY KEY,"
+            " year INTEGER NOT NULL,"
+            " record TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def add_records(self, records):
+        """Remember paper records (dicts from Paper.to_dict) without embedding them."""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO papers VALUES (?, ?, ?)",
+                [(r["arxiv_id"], int(r["published"][:4]), json.dumps(r))
+                 for r in records]
+            )
+            self._conn.commit()
+
+    def add(self, records, embedder, batch_size=64):
+        """Remember paper records and make sure their abstracts are embedded."""
+        self.add_records(records)
+        if self.store is not None and records:
+            self.store.encode(
+                embedder,
+                [r["arxiv_id"] for r in records],
+                [r["summary"] for r in records],
+                batch_size=batch_size
+            )
+
+    def _refresh(self):
+        counts = (
+            self._conn.execute("SELECT COUNT(*) FROM papers").fetchone()[0],
+            len(self.store)
+        )
+        if counts == self._seen_counts:
+            return
+        self._seen_counts = counts
+
+        rows = self._conn.execute("SELECT arxiv_id, year FROM papers").fetchall()
+        known, _ = self.store.lookup(
+            [arxiv_id for arxiv_id, _ in rows if arxiv_id not in self._row_of])
+        if not known:
+            return
+        year_of = dict(rows)
+        vectors = self.store.get(known)
+
+        start = len(self._ids)
+        self._ids.extend(known)
+        self._row_of.update((arxiv_id, start + i) for i, arxiv_id in enumerate(known))
+        self._vectors = vectors if start == 0 else np.vstack([self._vectors, vectors])
+        self._years = np.concatenate(
+            [self._years, np.array([year_of[i] for i in known], dtype=np.int32)])
+
+        total = len(self._ids)
+        if total >= IVF_MIN_PAPERS and (self._centroids is None or total > 2 * self._trained_n):
+            n_lists = int(np.sqrt(total))
+            self._centroids = _spherical_kmeans(self._vectors, n_lists)
+            self._assign = np.argmax(self._vectors @ self._centroids.T, axis=1)
+            self._trained_n = total
+        elif self._centroids is not None:
+            self._assign = np.concatenate(
+                [self._assign, np.argmax(vectors @ self._centroids.T, axis=1)])
+
+    def search(self, query_vector, k, start_year=None, end_year=None):
+        """Return up to k (record, score) pairs, best first, within the year range."""
+        if self.store is None:
+            return []
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        query_vector = query_vector / (np.linalg.norm(query_vector) or 1)
+
+        with self._lock:
+            self._refresh()
+            if not self._ids:
+                return []
+            if self._centroids is None:
+                candidates = np.arange(len(self._ids))
+            else:
+                n_probe = min(self.n_probe, len(self._centroids))
+                probe = top_k_indices(self._centroids @ query_vector, n_probe)
+                candidates = np.flatnonzero(np.isin(self._assign, probe))
+            if start_year is not None:
+                candidates = candidates[self._years[candidates] >= start_year]
+            if end_year is not None:
+                candidates = candidates[self._years[candidates] <= end_year]
+            if not len(candidates):
+                return []
+
+            scores = self._vectors[candidates] @ query_vector
+            top = top_k_indices(scores, k)
+            hits = [(self._ids[candidates[i]], float(scores[i])) for i in top]
+            placeholders = ",".join("?" * len(hits))
+            records = dict(self._conn.execute(
+                f"SELECT arxiv_id, record FROM papers WHERE arxiv_id IN ({placeholders})",
+                [arxiv_id for arxiv_id, _ in hits]
+            ).fetchall())
+        return [(json.loads(records[arxiv_id]), score) for arxiv_id, score in hits]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_paper_index(model_name):
+    """Process-wide index for the model, or None when caching is disabled or unavailable."""
+    if cache_disabled():
+        return None
+    with _indexes_lock:
+        if model_name not in _indexes:
+            try:
+                _indexes[model_name] = PaperIndex(model_name)
+            except Exception as e:
+                print(f"Paper index unavailable: {e}")
+                _indexes[model_name] = None
+    return _indexes[model_name]